@@ -0,0 +1,94 @@
+# Local cache of the panel BIM metadata, keyed by the panel number (the document name without its version).
+# The cache is a SQLite file filled from a BIM export (CSV or JSON) or a local stand-in service, so the summary can
+# show the BIM fields of a panel without a browser round-trip. Does not use the Fusion API, so it can run on a thread.
+
+import csv, json, os, sqlite3, time, urllib.parse, urllib.request
+
+# Column of the panel number in a CSV export, or key in a JSON export.
+panel_column = "Panel"
+
+def connect(path):          # This function opens the cache and creates its tables the first time.
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=5)
+    connection.execute("CREATE TABLE IF NOT EXISTS panels (panel TEXT PRIMARY KEY, fields TEXT, source TEXT, fetched REAL)")
+    connection.execute("CREATE TABLE IF NOT EXISTS imports (source TEXT PRIMARY KEY, modified REAL)")
+    return connection
+
+def lookup(path, panel):    # This function returns the cached BIM fields of a panel, None if the panel is not cached.
+    if not os.path.exists(path):
+        return None
+    connection = connect(path)
+    try:
+        row = connection.execute("SELECT fields FROM panels WHERE panel = ?", (panel,)).fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        connection.close()
+
+def store(path, records, source):  # This function adds or replaces the BIM fields of panels, records is {panel: fields}.
+    connection = connect(path)
+    try:
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO panels VALUES (?, ?, ?, ?)",
+                                   [(panel, json.dumps(fields), source, time.time()) for panel, fields in records.items()])
+    finally:
+        connection.close()
+
+def readExport(export_file):  # This function reads the BIM fields by panel from a CSV or JSON export.
+    if export_file.lower().endswith(".json"):
+        with open(export_file, "r") as json_file:
+            rows = json.load(json_file)
+    else:
+        with open(export_file, "r", newline="", encoding="utf-8-sig") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+    return {str(row[panel_column]).strip(): {key: value for key, value in row.items() if key != panel_column}
+            for row in rows if row.get(panel_column)}
+
+def importExport(path, export_file):  # This function loads the export into the cache when it changed since the last import, returns the panels loaded.
+    if not export_file or not os.path.exists(export_file):
+        return 0
+    modified = os.path.getmtime(export_file)
+    connection = connect(path)
+    try:
+        row = connection.execute("SELECT modified FROM imports WHERE source = ?", (export_file,)).fetchone()
+    finally:
+        connection.close()
+    if row and row[0] >= modified:
+        return 0
+
+    records = readExport(export_file)
+    store(path, records, export_file)
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO imports VALUES (?, ?)", (export_file, modified))
+    finally:
+        connection.close()
+    return len(records)
+
+def fetchService(service_url, panel, timeout=2.0):  # This function asks the stand-in service for the BIM fields of a panel, None if it has none.
+    url = service_url.format(panel=urllib.parse.quote(panel))
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            fields = json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    return fields if isinstance(fields, dict) and fields else None
+
+def prefetch(path, panels, export_file=None, service_url=None):  # This function fills the cache for the upcoming panels and returns what it did.
+    result = {"imported": importExport(path, export_file), "fetched": 0, "missing": []}
+    for panel in panels:
+        if lookup(path, panel) is not None:
+            continue
+        fields = fetchService(service_url, panel) if service_url else None
+        if fields is None:
+            result["missing"].append(panel)
+            continue
+        store(path, {panel: fields}, service_url)
+        result["fetched"] += 1
+    return result
+
+def summaryLine(fields, names):  # This function formats the BIM fields shown in the summary.
+    shown = [f"{name}: {fields[name]}" for name in names if fields.get(name) not in (None, "")]
+    return ", ".join(shown)
@@ -0,0 +1,349 @@
+# Compaction pass for the posted Melvin and Charles programs.
+# Streams a posted program and replaces runs of short G1 moves by the fewest G1 lines and G2/G3 arcs (G17, I/J
+# center offsets) that stay within the tolerance, and drops motion, feed and coordinate words that repeat the modal
+# state. The verify mode measures how far the compacted path is from the original. Runs without Fusion:
+#
+#   python NCCompactor.py "1234C.ngc" --verify                      compact the program in place
+#   python NCCompactor.py "1234C.ngc" -o "1234C compact.ngc" -t 0.0005
+
+import argparse, math, os, re, sys
+
+tolerance = 0.001           # Default distance the compacted path may be from the original (program units).
+max_radius = 1000.0         # Larger arcs are left as lines.
+max_run = 5000              # Moves buffered before a run is compacted, keeps the memory used by a long pass bounded.
+search_window = 25          # Segments searched past the closest one when the paths are compared.
+
+word = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+comment = re.compile(r"\([^)]*\)|;.*")
+
+def fmt(value):             # This function formats a coordinate the way the post does, e.g. "1.25" or "0.".
+    text = f"{value:.4f}".rstrip("0")
+    return "0." if text in ("-0.", "0.") else text
+
+def distanceToSegment(point, start, end):  # This function returns the distance of a point to a segment and where it projects on it (0 to 1).
+    direction = [e - s for s, e in zip(start, end)]
+    length = sum(d * d for d in direction)
+    t = 0.0 if length == 0 else max(0.0, min(1.0, sum((p - s) * d for p, s, d in zip(point, start, direction)) / length))
+    return math.dist(point, [s + t * d for s, d in zip(start, direction)]), t
+
+def circle(a, b, c):        # This function returns the XY center and radius of the circle through three points, None if they are in line.
+    d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+    if abs(d) < 1e-12:
+        return None
+    a2, b2, c2 = a[0] ** 2 + a[1] ** 2, b[0] ** 2 + b[1] ** 2, c[0] ** 2 + c[1] ** 2
+    x = (a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d
+    y = (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d
+    return (x, y), math.hypot(a[0] - x, a[1] - y)
+
+def lineFits(points, i, j, tol):  # This function checks if the points between i and j are within the tolerance of the line from i to j.
+    previous = 0.0
+    for k in range(i + 1, j):
+        distance, t = distanceToSegment(points[k], points[i], points[j])
+        if distance > tol or t < previous:
+            return False
+        previous = t
+    return True
+
+def arcFits(points, i, j, tol):  # This function returns the center and direction of the arc through the points i to j, None if they are not on one.
+    if j - i < 3 or any(abs(points[k][2] - points[i][2]) > tol / 10 for k in range(i + 1, j + 1)):
+        return None
+    fitted = circle(points[i], points[(i + j) // 2], points[j])
+    if not fitted or fitted[1] > max_radius:
+        return None
+    center, radius = fitted
+
+    sweep, direction = 0.0, 0
+    for k in range(i, j):
+        a, b = points[k], points[k + 1]
+        if abs(math.hypot(b[0] - center[0], b[1] - center[1]) - radius) > tol:
+            return None
+        step = math.atan2((a[0] - center[0]) * (b[1] - center[1]) - (a[1] - center[1]) * (b[0] - center[0]),
+                          (a[0] - center[0]) * (b[0] - center[0]) + (a[1] - center[1]) * (b[1] - center[1]))
+        if step == 0 or (direction and (step > 0) != (direction > 0)):
+            return None
+        direction = 1 if step > 0 else -1
+        sweep += abs(step)
+
+        # The arc between two points may not bulge further than the tolerance from the original move.
+        chord = math.hypot(b[0] - a[0], b[1] - a[1])
+        if radius - math.sqrt(max(radius ** 2 - (chord / 2) ** 2, 0.0)) > tol:
+            return None
+    if sweep >= 2 * math.pi * 0.999:
+        return None
+    return center, direction < 0
+
+def longest(points, i, fits, minimum):  # This function returns the furthest point j for which fits(i, j) holds, searching in growing steps.
+    last = len(points) - 1
+    if i + minimum > last or not fits(i, i + minimum):
+        return None
+    good, step = i + minimum, 1
+    while good + step <= last and fits(i, good + step):
+        good += step
+        step *= 2
+    bad = min(good + step, last + 1)
+    while bad - good > 1:
+        middle = (good + bad) // 2
+        if fits(i, middle):
+            good = middle
+        else:
+            bad = middle
+    return good
+
+def fitRun(points, tol):    # This function splits a run of points into lines and arcs, points[0] is where the run starts.
+    segments = []
+    i = 0
+    while i < len(points) - 1:
+        line_end = longest(points, i, lambda a, b: lineFits(points, a, b, tol), 1)
+        arc_end = longest(points, i, lambda a, b: arcFits(points, a, b, tol) is not None, 3)
+        if arc_end is not None and arc_end > line_end:
+            center, clockwise = arcFits(points, i, arc_end, tol)
+            segments.append(("arc", points[i], points[arc_end], center, clockwise))
+            i = arc_end
+        else:
+            segments.append(("line", points[i], points[line_end], None, None))
+            i = line_end
+    return segments
+
+class Writer:               # This class writes the compacted lines and drops the words that repeat the modal state.
+    def __init__(self, output):
+        self.output = output
+        self.motion = None
+        self.feed = None
+        self.position = [None, None, None]
+        self.lines = 0
+        self.arcs = 0
+
+    def raw(self, line):
+        self.output.write(line)
+        self.lines += 1
+
+    def move(self, motion, end, feed=None, center=None, prefix=""):
+        words = []
+        for axis, value, current in zip("XYZ", end, self.position):
+            # Arcs always have their X and Y end point.
+            if current is None or fmt(value) != fmt(current) or (center and axis != "Z"):
+                words.append(f"{axis}{fmt(value)}")
+        if center:
+            words.append(f"I{fmt(center[0] - self.position[0])}")
+            words.append(f"J{fmt(center[1] - self.position[1])}")
+            self.arcs += 1
+        if feed is not None and feed != self.feed:
+            words.append(f"F{fmt(feed)}")
+            self.feed = feed
+        if not words:
+            return              # The tool is already there.
+        if motion != self.motion:
+            words.insert(0, f"G{motion}")
+            self.motion = motion
+        self.position = list(end)
+        self.raw(prefix + " ".join(words) + "\n")
+
+def compactLines(lines, output, tol=tolerance):  # This function compacts the lines of a program into output and returns the line counts.
+    writer = Writer(output)
+    state = {"motion": None, "absolute": True, "plane": 17, "feed": None, "scale": 1.0}
+    position = [None, None, None]
+    run, run_feed, run_prefix = [], None, ""
+    input_lines = 0
+
+    def flush():            # This function writes the buffered run, the next run starts where it ends.
+        if len(run) > 1:
+            for n, (kind, start, end, center, clockwise) in enumerate(fitRun(run, tol * state["scale"])):
+                writer.move((2 if clockwise else 3) if kind == "arc" else 1, end, run_feed, center, "" if n else run_prefix)
+        del run[:]
+
+    for raw in lines:
+        input_lines += 1
+        text = raw.strip()
+        body = comment.sub("", text).upper()
+        words = word.findall(body)
+        letters = [letter for letter, _ in words]
+        prefix = ""
+        if letters and letters[0] == "N":
+            prefix = f"N{words[0][1]} "
+            words, letters = words[1:], letters[1:]
+
+        codes = [round(float(value), 1) for letter, value in words if letter == "G"]
+        motion = next((int(code) for code in codes if code in (0, 1)), None)
+        simple = (words and text == body.strip() and set(letters) <= set("GXYZF") and all(code in (0, 1) for code in codes)
+                  and state["absolute"] and state["plane"] == 17)
+        if simple:
+            motion = state["motion"] if motion is None else motion
+            simple = motion in (0, 1) and not (motion == 0 and "F" in letters)
+        if simple:
+            values = {letter: float(value) for letter, value in words}
+            end = [values.get(axis, current) for axis, current in zip("XYZ", position)]
+            feed = values.get("F", state["feed"])
+
+        if simple and motion == 1 and None not in position and None not in end:
+            if run and (feed != run_feed or len(run) >= max_run):
+                flush()
+            if not run:
+                run.append(list(position))
+                run_feed, run_prefix = feed, prefix
+            run.append(end)
+            state["motion"], state["feed"], position = motion, feed, end
+            continue
+
+        flush()
+        if simple and None not in end:
+            writer.move(motion, end, feed if motion == 1 else None, prefix=prefix)
+            state["motion"], state["feed"], position = motion, feed, end
+            continue
+
+        # Every other line is written as posted, the modal state is tracked so the following runs can be compacted.
+        # Canned cycles stay modal until G80, the lines in between are written as posted.
+        writer.raw(raw if raw.endswith("\n") else raw + "\n")
+        for letter, value in words:
+            number = float(value)
+            if letter == "G":
+                code = round(number, 1)
+                if code in (0, 1, 2, 3):
+                    state["motion"] = int(code)
+                elif 81 <= code <= 89:
+                    state["motion"] = code
+                elif code == 80:
+                    state["motion"] = None
+                elif code in (17, 18, 19):
+                    state["plane"] = int(code)
+                elif code in (90, 91):
+                    state["absolute"] = code == 90
+                elif code in (20, 21):
+                    state["scale"] = 1.0 if code == 20 else 25.4
+                elif code in (28, 30, 53, 92) or 81 <= code <= 89:
+                    position = [None, None, None]       # The position is not known until the next full move.
+            elif letter == "F":
+                state["feed"] = number
+        if not state["absolute"]:
+            position = [None, None, None]
+        elif 53 not in codes:
+            for letter, value in words:
+                if letter in "XYZ" and state["motion"] in (0, 1, 2, 3):
+                    position["XYZ".index(letter)] = float(value)
+        # The writer keeps the motion and feed it last wrote, unless the posted line changed them on the controller.
+        if any(code in (0, 1, 2, 3) or 80 <= code <= 89 for code in codes):
+            writer.motion = state["motion"]
+        if "F" in letters:
+            writer.feed = state["feed"]
+        writer.position = list(position)
+    flush()
+    return {"inputLines": input_lines, "outputLines": writer.lines, "arcs": writer.arcs}
+
+def compact(path, output_path=None, tol=tolerance):  # This function compacts a posted program, in place unless an output file is given, and reports the reduction.
+    output_path = output_path or path
+    temporary = output_path + ".compact"
+    with open(path, "r", buffering=1 << 20) as program, open(temporary, "w", buffering=1 << 20) as output:
+        report = compactLines(program, output, tol)
+    report["inputBytes"] = os.path.getsize(path)
+    report["outputBytes"] = os.path.getsize(temporary)
+    os.replace(temporary, output_path)
+    return report
+
+def pathPoints(lines, tol):  # This function returns the points of the moves of a program, arcs are split into chords within a tenth of the tolerance.
+    # An arc move without its center (I/J/K) or radius (R) is an error, it would not run as a line on the controller.
+    state = {"motion": None, "absolute": True, "plane": 17}
+    position = [None, None, None]
+    for raw in lines:
+        words = word.findall(comment.sub("", raw).upper())
+        values, skip = {}, False
+        for letter, value in words:
+            number = float(value)
+            if letter == "G":
+                code = round(number, 1)
+                if code in (0, 1, 2, 3):
+                    state["motion"] = int(code)
+                elif code in (90, 91):
+                    state["absolute"] = code == 90
+                elif code in (17, 18, 19):
+                    state["plane"] = int(code)
+                elif code == 53:
+                    skip = True
+            else:
+                values[letter] = number
+        if skip or not any(axis in values for axis in "XYZ"):
+            continue
+        end = [values.get(axis, current) if state["absolute"] or current is None else current + values.get(axis, 0.0)
+               for axis, current in zip("XYZ", position)]
+        if state["motion"] in (2, 3) and not any(letter in values for letter in "IJKR"):
+            raise ValueError(f"G{state['motion']} move without a center or radius: {raw.strip()}")
+        if state["motion"] in (2, 3) and state["plane"] == 17 and None not in position and ("I" in values or "J" in values):
+            center = (position[0] + values.get("I", 0.0), position[1] + values.get("J", 0.0))
+            radius = math.hypot(position[0] - center[0], position[1] - center[1])
+            start_angle = math.atan2(position[1] - center[1], position[0] - center[0])
+            sweep = math.atan2(end[1] - center[1], end[0] - center[0]) - start_angle
+            if state["motion"] == 2:
+                sweep = -((-sweep) % (2 * math.pi) or 2 * math.pi)
+            else:
+                sweep = sweep % (2 * math.pi) or 2 * math.pi
+            chord = math.sqrt(8 * radius * tol / 10) if radius > 0 else 1.0
+            count = max(1, math.ceil(abs(sweep) * radius / chord))
+            for k in range(1, count):
+                angle = start_angle + sweep * k / count
+                yield [center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle),
+                       position[2] + (end[2] - position[2]) * k / count]
+        if None not in end:
+            yield end
+        position = end
+
+def deviation(points, path):  # This function returns how far the points are from the path, both are followed in order.
+    worst, segment = 0.0, 0
+    for point in points:
+        best = math.inf
+        # The closest segment is at or after the closest segment of the previous point, the search stops once
+        # search_window segments in a row are not closer.
+        k, misses = segment, 0
+        while k < len(path) - 1 and misses < search_window:
+            distance, _ = distanceToSegment(point, path[k], path[k + 1])
+            if distance < best:
+                best, segment, misses = distance, k, 0
+            else:
+                misses += 1
+            k += 1
+        worst = max(worst, best if best != math.inf else math.dist(point, path[-1]))
+    return worst
+
+def verify(original_path, compacted_path, tol=tolerance):  # This function checks the compacted program stays within the tolerance of the original.
+    try:
+        with open(original_path, "r") as original, open(compacted_path, "r") as compacted:
+            original_points = list(pathPoints(original, tol))
+            compacted_points = list(pathPoints(compacted, tol))
+    except ValueError as error:
+        return {"maxDeviation": math.inf, "ok": False, "error": str(error)}
+    worst = max(deviation(original_points, compacted_points), deviation(compacted_points, original_points)) \
+        if original_points and compacted_points else 0.0
+    same_end = bool(original_points) == bool(compacted_points) and \
+        (not original_points or math.dist(original_points[-1], compacted_points[-1]) <= tol)
+    return {"maxDeviation": worst, "ok": worst <= tol * 1.1 and same_end}
+
+def summary(name, report):  # This function formats the reduction of a compacted program for the script summary.
+    lines = 1 - report["outputLines"] / max(report["inputLines"], 1)
+    size = 1 - report["outputBytes"] / max(report["inputBytes"], 1)
+    return (f"{name} compacted: {report['inputLines']} → {report['outputLines']} lines ({lines:.0%}), "
+            f"{report['inputBytes'] / 1024:.1f} → {report['outputBytes'] / 1024:.1f} KB ({size:.0%}), {report['arcs']} arcs")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact a posted program with arc fitting and redundant move removal.")
+    parser.add_argument("program")
+    parser.add_argument("-o", "--output", help="write the compacted program to this file instead of replacing the program")
+    parser.add_argument("-t", "--tolerance", type=float, default=tolerance)
+    parser.add_argument("--verify", action="store_true", help="check the compacted path against the original")
+    args = parser.parse_args()
+
+    original = args.program + ".original"
+    if args.verify:
+        with open(args.program, "r") as source, open(original, "w") as copy:
+            copy.writelines(source)
+    report = compact(args.program, args.output, args.tolerance)
+    print(summary(os.path.basename(args.program), report))
+    if not args.verify:
+        return 0
+
+    checked = verify(original, args.output or args.program, args.tolerance)
+    os.remove(original)
+    if "error" in checked:
+        print(f"FAIL {checked['error']}")
+    else:
+        print(f"Maximum deviation {checked['maxDeviation']:.5f}, {'within' if checked['ok'] else 'OUTSIDE'} the tolerance {args.tolerance}")
+    return 0 if checked["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# Streaming validator for the posted Melvin and Charles programs.
+# Reads a program line by line, tracks the modal state and checks every move against the envelope profile of the
+# machine. Does not use the Fusion API, so posted programs can be checked on any machine with Python:
+#
+#   python NCValidator.py Charles "C:\Users\ahughes\Documents\NC Programs\1234C.ngc"
+
+import argparse, json, math, re, sys
+
+# Envelope profiles in inches, relative to the WCS of the program. They must match the soft limits of the machines.
+machine_profiles = {
+    "Melvin": {
+        "min": [-300.0, -150.0, -1.0],
+        "max": [300.0, 150.0, 6.0],
+        "maxFeed": 1000.0,          # in/min
+        "rapidFeed": 1200.0,        # in/min, used for the rapid time estimate
+        "wcs": ["G54"],
+        "tools": None               # Allowed tool numbers, None allows every tool.
+    },
+    "Charles": {
+        "min": [-300.0, -150.0, -2.0],
+        "max": [300.0, 150.0, 14.0],
+        "maxFeed": 800.0,
+        "rapidFeed": 1200.0,
+        "wcs": ["G54"],
+        "tools": None
+    }
+}
+
+axes = "XYZ"
+word = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+comment = re.compile(r"\([^)]*\)|;.*")
+
+# Arc planes: the two arc axes (indexes into XYZ) and their center offset words.
+arc_planes = {17: ((0, 1), "IJ"), 18: ((2, 0), "KI"), 19: ((1, 2), "JK")}
+
+def arcPoints(start, end, offsets, plane, clockwise):  # This function returns the arc length and the points where the arc reaches its extremes.
+    (a, b), words = arc_planes[plane]
+    center = [start[a] + offsets.get(words[0], 0.0), start[b] + offsets.get(words[1], 0.0)]
+    radius = math.hypot(start[a] - center[0], start[b] - center[1])
+    angle_start = math.atan2(start[b] - center[1], start[a] - center[0])
+    angle_end = math.atan2(end[b] - center[1], end[a] - center[0])
+    sweep = (angle_start - angle_end) if clockwise else (angle_end - angle_start)
+    sweep %= 2 * math.pi
+    if sweep < 1e-9:
+        sweep = 2 * math.pi     # Start and end on the same point is a full circle.
+
+    points = []
+    for quarter in range(4):
+        angle = quarter * math.pi / 2
+        travelled = ((angle_start - angle) if clockwise else (angle - angle_start)) % (2 * math.pi)
+        if travelled <= sweep:
+            point = list(end)
+            point[a] = center[0] + radius * math.cos(angle)
+            point[b] = center[1] + radius * math.sin(angle)
+            points.append(point)
+    length = math.hypot(radius * sweep, end[3 - a - b] - start[3 - a - b])
+    return length, points
+
+def validateLines(lines, profile):  # This function checks the lines of a program against a machine profile and returns the report.
+    position = [None, None, None]
+    bounds = [[math.inf, -math.inf] for _ in axes]
+    state = {"motion": 0, "absolute": True, "scale": 1.0, "plane": 17, "feed": None,
+             "tool": None, "nextTool": None, "spindle": False, "wcs": None}
+    report = {"lines": 0, "feedDistance": 0.0, "rapidDistance": 0.0, "feedTime": 0.0, "tools": {}, "wcs": []}
+    problems = {}
+
+    def problem(kind, line_number):
+        found = problems.setdefault(kind, {"line": line_number, "count": 0})
+        found["count"] += 1
+
+    def check(point, line_number):
+        for i, value in enumerate(point):
+            if value is None:
+                continue
+            bounds[i][0] = min(bounds[i][0], value)
+            bounds[i][1] = max(bounds[i][1], value)
+            if value < profile["min"][i] - 1e-6:
+                problem(f"{axes[i]} below the envelope minimum {profile['min'][i]}", line_number)
+            elif value > profile["max"][i] + 1e-6:
+                problem(f"{axes[i]} above the envelope maximum {profile['max'][i]}", line_number)
+
+    for line_number, raw in enumerate(lines, 1):
+        report["lines"] = line_number
+        words = word.findall(comment.sub("", raw).upper())
+        if not words:
+            continue
+
+        target = {}
+        offsets = {}
+        machine_coordinates = False
+        motion = None
+        for letter, text in words:
+            value = float(text)
+            if letter == "G":
+                code = round(value, 1)
+                if code in (0, 1, 2, 3):
+                    motion = int(code)
+                elif code == 80:
+                    state["motion"] = None
+                elif 81 <= code <= 89:
+                    motion = 0          # Canned cycles are checked as moves to their X, Y and Z.
+                elif code in (17, 18, 19):
+                    state["plane"] = int(code)
+                elif code == 20:
+                    state["scale"] = 1.0
+                elif code == 21:
+                    state["scale"] = 1 / 25.4
+                elif code == 90:
+                    state["absolute"] = True
+                elif code == 91:
+                    state["absolute"] = False
+                elif code == 53:
+                    machine_coordinates = True
+                elif 54 <= code <= 59.3:
+                    state["wcs"] = f"G{text.lstrip('0') or '0'}"
+                    if state["wcs"] not in report["wcs"]:
+                        report["wcs"].append(state["wcs"])
+                    if state["wcs"] not in profile["wcs"]:
+                        problem(f"Work offset {state['wcs']} is not used on this machine", line_number)
+            elif letter == "M":
+                code = int(value)
+                if code == 6:
+                    state["tool"] = state["nextTool"]
+                    if profile["tools"] is not None and state["tool"] not in profile["tools"]:
+                        problem(f"Tool T{state['tool']} is not loaded on this machine", line_number)
+                elif code in (3, 4):
+                    state["spindle"] = True
+                elif code in (5, 30, 2):
+                    state["spindle"] = False
+            elif letter == "T":
+                state["nextTool"] = int(value)
+            elif letter == "F":
+                state["feed"] = value * state["scale"]
+                if state["feed"] > profile["maxFeed"]:
+                    problem(f"Feed above the machine maximum {profile['maxFeed']} in/min", line_number)
+            elif letter in axes:
+                target[axes.index(letter)] = value * state["scale"]
+            elif letter in "IJK":
+                offsets[letter] = value * state["scale"]
+
+        if motion is not None:
+            state["motion"] = motion
+        if not target or state["motion"] is None or machine_coordinates:
+            continue
+
+        # Resolve the end point of the move from the modal distance mode.
+        end = list(position)
+        for i, value in target.items():
+            if state["absolute"]:
+                end[i] = value
+            elif position[i] is None:
+                problem("Incremental move before the position is known", line_number)
+            else:
+                end[i] = position[i] + value
+        if state["wcs"] is None:
+            problem("Move before a work offset is selected", line_number)
+
+        known = None not in position and None not in end
+        if state["motion"] == 0:
+            if known:
+                report["rapidDistance"] += math.dist(position, end)
+        else:
+            if state["feed"] is None:
+                problem("Feed move before a feed rate is set", line_number)
+            if state["tool"] is None:
+                problem("Feed move before a tool change", line_number)
+            if not state["spindle"]:
+                problem("Feed move with the spindle off", line_number)
+            if known:
+                # Arcs given by their radius (R) are measured as a straight line between the end points.
+                if state["motion"] in (2, 3) and not any(letter == "R" for letter, _ in words):
+                    length, extremes = arcPoints(position, end, offsets, state["plane"], state["motion"] == 2)
+                    for point in extremes:
+                        check(point, line_number)
+                else:
+                    length = math.dist(position, end)
+                report["feedDistance"] += length
+                if state["feed"]:
+                    report["feedTime"] += length / state["feed"]
+                tool = report["tools"].setdefault(f"T{state['tool']}", {"feedDistance": 0.0, "moves": 0})
+                tool["feedDistance"] += length
+                tool["moves"] += 1
+
+        check(end, line_number)
+        position = end
+
+    report["rapidTime"] = report["rapidDistance"] / profile["rapidFeed"]
+    report["bounds"] = {axes[i]: bounds[i] if bounds[i][0] <= bounds[i][1] else None for i in range(3)}
+    report["problems"] = [f"{kind} (line {found['line']}, {found['count']} lines)" for kind, found in problems.items()]
+    return report
+
+def validate(path, machine):  # This function checks a posted program against the profile of a machine.
+    with open(path, "r", buffering=1 << 20) as program:
+        report = validateLines(program, machine_profiles[machine])
+    report["machine"] = machine
+    return report
+
+def summary(report):        # This function formats the totals of a report for the script summary.
+    tools = ", ".join(f"{name} {tool['feedDistance']:.0f} in" for name, tool in report["tools"].items())
+    return (f"{report['machine']}: {report['lines']} lines, feed {report['feedDistance']:.0f} in "
+            f"({report['feedTime']:.1f} min), rapid {report['rapidDistance']:.0f} in ({report['rapidTime']:.1f} min)"
+            + (f", tools {tools}" if tools else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a posted program against the envelope profile of a machine.")
+    parser.add_argument("machine", choices=sorted(machine_profiles))
+    parser.add_argument("program")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    report = validate(args.program, args.machine)
+    print(json.dumps(report, indent=4) if args.json else summary(report))
+    for found in report["problems"]:
+        print(f"FAIL {found}")
+    return 1 if report["problems"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
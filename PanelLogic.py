@@ -0,0 +1,785 @@
+# Panel decision logic that does not depend on the Fusion API.
+# Everything in this module works on plain Python values so it can be tested without Fusion.
+
+import functools, hashlib, json, math, re, time
+
+# NumPy is optional, without it the script falls back to the Fusion bounding boxes.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Operation parameters that decide if a toolpath has to be regenerated.
+fingerprint_parameters = [
+    "passAngle",
+    "transitionType",
+    "bottomHeight_offset",
+    "topHeight_offset"
+]
+
+def geometryHash(values, decimals=4):   # This function hashes a list of geometry measurements rounded to the given decimals.
+    rounded = [round(float(value), decimals) + 0.0 for value in values]
+    return hashlib.sha1(json.dumps(rounded).encode("utf-8")).hexdigest()
+
+def toolpathFingerprint(expressions, stock_hash):   # This function creates the fingerprint of an operation from its parameter expressions and stock hash.
+    # Only the fingerprint parameters are used, a missing parameter is stored as None.
+    fingerprint = {
+        "parameters": {name: expressions.get(name) for name in fingerprint_parameters},
+        "stock": stock_hash
+    }
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Component thicknesses (inches) used to identify the bodies of a panel.
+foam_thickness = 3.0
+stud_thickness = 6.0
+track_thickness = 6.143
+sheathing_thickness = 0.625
+bump_track_length = 6.086
+bump_stud_length = 6.0
+bump_stud_width = 2.5
+
+# The Stock body is a copy of the Exterior moved -.4 in the Y-axis (will be machine +Z axis).
+# The offset is set per machine, the Stock body is built for the machine that uses it.
+stock_machine = "Charles"
+stock_offsets = {
+    "Charles": [0, -0.4, 0]
+}
+
+return_templates = ["Charles Return EM", "Charles Return FM"]
+
+# Templates that must be loaded before a template, by setup. The facinghead sets the surface height for every other
+# operation and each EM (roughing) operation comes before its FM (finishing) operation.
+template_precedence = {
+    "Charles": {
+        "Charles Perimeter": ["Charles Facinghead"],
+        "Charles Perimeter Above Sheathing": ["Charles Facinghead", "Charles Perimeter"],
+        "Charles Bump Clean Up FM": ["Charles Facinghead"],
+        "Charles Brick Feature EM": ["Charles Facinghead"],
+        "Charles Brick Feature FM": ["Charles Facinghead", "Charles Brick Feature EM"],
+        "Charles Return EM": ["Charles Facinghead"],
+        "Charles Return FM": ["Charles Facinghead", "Charles Return EM"]
+    }
+}
+
+# Charles facinghead used by the collision pre-check (inches). The heights are measured from the Charles WCS (Point2)
+# toward the front of the panel (machine +Z) and default to the Facinghead template values.
+facinghead = {
+    "diameter": 6.0,
+    "length": 2.0,
+    "holderDiameter": 8.0,
+    "holderLength": 10.0,
+    "overtravel": 1.0           # Distance the facinghead runs past the stock at the end of each pass.
+}
+facinghead_defaults = {
+    "passAngle": "0 deg",
+    "bottomHeight_offset": "9.25 in",
+    "topHeight_offset": "9.5 in"
+}
+# Bodies the facinghead is meant to cut, they are not checked for collisions.
+faced_bodies = ["Stock", "Exterior", "Foam"]
+
+# Setup parameters shared by the Melvin and Charles setups. Strings are expressions, other values are set as the parameter value.
+setup_parameters = {
+    "job_stockMode": "'solid'",
+    "wcs_origin_mode": "'point'",
+    "wcs_orientation_flipX": True,
+    "wcs_orientation_flipZ": True
+}
+
+# Box stock: setups whose stock body fills its bounding box use a fixed box stock instead of the solid stock body, which
+# makes every toolpath generation faster. A body fills its box when its volume is within box_fill_tolerance of the box.
+box_stock = True
+box_fill_tolerance = 0.01
+
+def in_cm(x):               # This function converts inches to cm.
+    return x * 2.54
+
+def size(body, axis):       # This function returns the size of a body along an axis (0 = X, 1 = Y, 2 = Z).
+    return body["max"][axis] - body["min"][axis]
+
+def thickness(body):        # This function returns the Y thickness of a body, measured from its mesh when available.
+    if body.get("thickness") is not None:
+        return body["thickness"]
+    return size(body, 1)
+
+# The version suffix of a document name, e.g. " v3".
+document_version = re.compile(r'\s*[vV]\d+')
+
+def panelNumber(document_name):  # This function removes the version from the document name.
+    return document_version.sub('', document_name)
+
+def transformExtents(min_point, max_point, matrix):  # This function transforms a bounding box by a 4x4 matrix (row-major list of 16) and returns the new bounding box.
+    corners = [[x, y, z] for x in (min_point[0], max_point[0])
+                         for y in (min_point[1], max_point[1])
+                         for z in (min_point[2], max_point[2])]
+    moved = [[matrix[row * 4] * c[0] + matrix[row * 4 + 1] * c[1] + matrix[row * 4 + 2] * c[2] + matrix[row * 4 + 3]
+              for row in range(3)] for c in corners]
+    return ([min(c[axis] for c in moved) for axis in range(3)],
+            [max(c[axis] for c in moved) for axis in range(3)])
+
+def meshArrays(coordinates, indices):  # This function converts the flat mesh lists from Fusion into vertex and triangle arrays.
+    return np.asarray(coordinates, dtype=float).reshape(-1, 3), np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+
+def transformVertices(vertices, matrix):  # This function transforms the vertices by a 4x4 matrix (row-major list of 16).
+    m = np.asarray(matrix, dtype=float).reshape(4, 4)
+    return vertices @ m[:3, :3].T + m[:3, 3]
+
+def meshExtents(vertices):  # This function returns the exact bounding box of the mesh vertices.
+    return vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist()
+
+def yPlanes(vertices, triangles, tolerance=0.01):  # This function returns the planes facing +Y or -Y as (y, area, direction), grouped within the tolerance (cm).
+    a, b, c = vertices[triangles[:, 0]], vertices[triangles[:, 1]], vertices[triangles[:, 2]]
+    cross = np.cross(b - a, c - a)
+    area = np.linalg.norm(cross, axis=1) / 2
+    facing = (area > 0) & (np.abs(cross[:, 1]) > 0.999 * np.linalg.norm(cross, axis=1))
+    if not facing.any():
+        return []
+
+    # Group the triangles by direction and by Y position rounded to the tolerance.
+    y = ((a[:, 1] + b[:, 1] + c[:, 1]) / 3)[facing]
+    direction = np.sign(cross[facing, 1])
+    keys = np.stack([np.round(y / tolerance), direction], axis=1)
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    areas = np.bincount(inverse, weights=area[facing])
+    heights = np.bincount(inverse, weights=y * area[facing]) / areas
+    return sorted((float(heights[i]), float(areas[i]), int(groups[i, 1])) for i in range(len(groups)))
+
+def largestPlaneNormal(vertices, triangles, tolerance=0.01, margin=0.01):  # This function returns the normal of the largest plane of a mesh, None when another plane is as large.
+    a, b, c = vertices[triangles[:, 0]], vertices[triangles[:, 1]], vertices[triangles[:, 2]]
+    cross = np.cross(b - a, c - a)
+    lengths = np.linalg.norm(cross, axis=1)
+    kept = lengths > 0
+    if not kept.any():
+        return None
+
+    # Group the triangles by direction and by plane offset rounded to the tolerance, the front and back of a slab are
+    # only told apart when one is larger, e.g. the back is cut short by a return.
+    normals = cross[kept] / lengths[kept, None]
+    offsets = np.einsum("ij,ij->i", normals, a[kept])
+    keys = np.column_stack([np.round(normals * 1000), np.round(offsets / tolerance)])
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    areas = np.bincount(inverse, weights=lengths[kept] / 2)
+    order = np.argsort(areas)[::-1]
+    if len(order) > 1 and areas[order[1]] >= (1 - margin) * areas[order[0]]:
+        return None
+    normal = normals[inverse == order[0]].sum(axis=0)
+    return (normal / np.linalg.norm(normal)).tolist()
+
+def meshThickness(planes, extents):  # This function measures the Y thickness between the front (-Y) and back (+Y) planes of a body.
+    front = [plane[0] for plane in planes if plane[2] < 0]
+    back = [plane[0] for plane in planes if plane[2] > 0]
+    if not front or not back:
+        return extents[1][1] - extents[0][1]
+    return max(back) - min(front)
+
+def nearestPlane(planes, y):  # This function returns the plane closest to a Y position and its distance.
+    if not planes:
+        return None, float('inf')
+    heights = np.array([plane[0] for plane in planes])
+    i = int(np.argmin(np.abs(heights - y)))
+    return planes[i], float(abs(heights[i] - y))
+
+def fillsBox(bodies):       # This function checks if a body, or bodies side by side, fill their bounding box.
+    union_min, union_max = unionExtents(bodies)
+    union = {"min": union_min, "max": union_max}
+    if all(body.get("volume") is not None for body in bodies):
+        box_volume = size(union, 0) * size(union, 1) * size(union, 2)
+        return sum(body["volume"] for body in bodies) >= box_volume * (1 - box_fill_tolerance)
+
+    # Without volumes only the front of the bodies can be compared, a single body is taken as filling its box.
+    box_area = size(union, 0) * size(union, 2)
+    return sum(size(body, 0) * size(body, 2) for body in bodies) >= box_area * (1 - box_fill_tolerance)
+
+def boxStockParameters(stock, model):  # This function returns the setup parameters of a fixed box stock with the extents of the stock body.
+    # The setup Z axis is the model -Y axis and X is flipped, so the setup axes are -X, -Z and -Y of the model.
+    parameters = {"job_stockMode": "'fixedbox'"}
+    for setup_axis, axis in zip("XYZ", (0, 2, 1)):
+        offset = ((stock["min"][axis] + stock["max"][axis]) - (model["min"][axis] + model["max"][axis])) / 2
+        parameters[f"job_stockFixed{setup_axis}"] = f"{size(stock, axis) / 2.54:.4f} in"
+        parameters[f"job_stockFixed{setup_axis}Mode"] = "'center'"
+        parameters[f"job_stockFixed{setup_axis}Offset"] = f"{-offset / 2.54 + 0.0:.4f} in"
+    return parameters
+
+def translateBody(body, vector):  # This function moves the bounding box of a body by a vector.
+    body["min"] = [body["min"][axis] + vector[axis] for axis in range(3)]
+    body["max"] = [body["max"][axis] + vector[axis] for axis in range(3)]
+
+def unionExtents(bodies):   # This function returns the bounding box around a list of bodies.
+    return ([min(body["min"][axis] for body in bodies) for axis in range(3)],
+            [max(body["max"][axis] for body in bodies) for axis in range(3)])
+
+def identifyThickness(bodies, target, name, tolerance=0.001):  # This function renames every body with the given Y thickness (inches).
+    for body in bodies:
+        if abs(thickness(body) - in_cm(target)) < in_cm(tolerance):
+            body["name"] = name
+
+def isBump(body):           # This function checks if a body has the size of a bump track or stud.
+    tolerance = in_cm(.001)
+    return (abs(size(body, 0) - in_cm(bump_track_length)) < tolerance or
+            (abs(size(body, 0) - in_cm(bump_stud_length)) < tolerance and
+             abs(thickness(body) - in_cm(bump_stud_width)) < tolerance))
+
+def identifyBump(bodies):   # This function renames the bump bodies and returns the side of the panel the bump is on.
+    for body in bodies:
+        if isBump(body):
+            body["name"] = "Bump"
+
+    bump = next((b for b in bodies if b["name"] == "Bump"), None)
+    if not bump:
+        return None
+    return "east" if abs(bump["min"][0]) < in_cm(20) else "west"
+
+def bumpCuts(bodies, side, has_foam):  # This function returns the cuts that keep the facinghead from cutting the bump.
+    # Stock is cut 32" from the bump side and Foam 8", the cuts are drawn on the XZ plane and extruded -15".
+    stock = next(b for b in bodies if b["name"] == "Stock")
+    cuts = []
+    for name, offset in [("Stock", 32), ("Foam", 8)]:
+        if name == "Foam" and not has_foam:
+            continue
+        if side == "east":
+            x1, x2 = -in_cm(offset), 0
+        else:
+            x1, x2 = stock["min"][0], stock["min"][0] + in_cm(offset)
+        cuts.append({"body": name, "x1": x1, "x2": x2, "depth": -in_cm(15)})
+    return cuts
+
+def cutBody(body, cut):     # This function trims the bounding box of a body by a cut that removes the full height between x1 and x2.
+    x1, x2 = min(cut["x1"], cut["x2"]), max(cut["x1"], cut["x2"])
+    if x1 <= body["min"][0] and body["max"][0] > x2:
+        body["min"][0] = max(body["min"][0], x2)
+    elif x2 >= body["max"][0] and body["min"][0] < x1:
+        body["max"][0] = min(body["max"][0], x1)
+
+def clearanceBox(cut):     # This function returns the min and max corners of the box removed by a cut.
+    # The cut rectangle is drawn on the XZ plane from Z = 0 down 550 cm and extruded along Y by the cut depth.
+    x1, x2 = min(cut["x1"], cut["x2"]), max(cut["x1"], cut["x2"])
+    y1, y2 = min(cut["depth"], 0), max(cut["depth"], 0)
+    return [x1, y1, -550], [x2, y2, 0]
+
+def expressionValue(expression):  # This function returns the number of a parameter expression such as "8.25 in" or "180 deg".
+    return float(expression.split()[0])
+
+def facingheadEnvelope(stock, operation, wcs_y):  # This function returns the boxes swept by the facinghead over the stock.
+    # The passes run along X for a 0 or 180 deg pass angle and along Z for 90 or 270 deg, the facinghead runs past
+    # the stock by its radius and the overtravel along the pass and by its radius across the passes.
+    values = dict(facinghead_defaults, **{name: operation[name] for name in facinghead_defaults if name in operation})
+    angle = math.radians(expressionValue(values["passAngle"]))
+    along_x = abs(math.cos(angle)) >= abs(math.sin(angle))
+    bottom = expressionValue(values["bottomHeight_offset"])
+    top = max(bottom, expressionValue(values["topHeight_offset"]))
+
+    boxes = []
+    for name, diameter, low, high in [
+        ("cutter", facinghead["diameter"], bottom, top + facinghead["length"]),
+        ("holder", facinghead["holderDiameter"], bottom + facinghead["length"], top + facinghead["length"] + facinghead["holderLength"])
+    ]:
+        reach = in_cm(diameter) / 2
+        run = reach + in_cm(facinghead["overtravel"])
+        extend_x, extend_z = (run, reach) if along_x else (reach, run)
+        boxes.append({
+            "name": name,
+            "min": [stock["min"][0] - extend_x, wcs_y - in_cm(high), stock["min"][2] - extend_z],
+            "max": [stock["max"][0] + extend_x, wcs_y - in_cm(low), stock["max"][2] + extend_z]
+        })
+    return boxes
+
+def aabbConflicts(boxes, bodies, tolerance=0.0254):  # This function returns the (body, box) index pairs whose bounding boxes overlap by more than the tolerance.
+    if not boxes or not bodies:
+        return []
+    if np is not None:
+        body_min = np.array([b["min"] for b in bodies], dtype=float)[:, None, :]
+        body_max = np.array([b["max"] for b in bodies], dtype=float)[:, None, :]
+        box_min = np.array([b["min"] for b in boxes], dtype=float)[None, :, :]
+        box_max = np.array([b["max"] for b in boxes], dtype=float)[None, :, :]
+        overlap = np.all((body_min < box_max - tolerance) & (body_max > box_min + tolerance), axis=2)
+        return [tuple(pair) for pair in np.argwhere(overlap).tolist()]
+    return [(i, j) for i, body in enumerate(bodies) for j, box in enumerate(boxes)
+            if all(body["min"][a] < box["max"][a] - tolerance and body["max"][a] > box["min"][a] + tolerance for a in range(3))]
+
+def facingheadCollisions(bodies, stock, operation, wcs_y):  # This function checks the facinghead sweep against every body it is not meant to cut.
+    boxes = facingheadEnvelope(stock, operation, wcs_y)
+    tested = [b for b in bodies if not any(b["name"].startswith(name) for name in faced_bodies)]
+    return [{"setup": "Charles", "operation": "Facinghead", "body": tested[i]["name"], "box": boxes[j]["name"]}
+            for i, j in aabbConflicts(boxes, tested)]
+
+def toolChanges(order, tools):  # This function counts the tool changes of templates loaded in order, tools lists the tool numbers of each template.
+    sequence = [tool for template in order for tool in tools.get(template, [])]
+    return sum(1 for previous, tool in zip(sequence, sequence[1:]) if tool != previous)
+
+def toolOrder(templates, tools, precedence):  # This function orders the templates for the fewest tool changes without breaking the precedence.
+    # Exact search over the loaded subsets, a setup only has a handful of templates. Ties keep the planned order.
+    required = [[templates.index(before) for before in precedence.get(template, []) if before in templates] for template in templates]
+    done = (1 << len(templates)) - 1
+
+    @functools.lru_cache(maxsize=None)
+    def best(loaded, last_tool):
+        if loaded == done:
+            return 0, ()
+        result = None
+        for i, template in enumerate(templates):
+            if loaded & (1 << i) or any(not loaded & (1 << j) for j in required[i]):
+                continue
+            sequence = tools.get(template, [])
+            changes = toolChanges([template], tools) + (1 if sequence and last_tool is not None and sequence[0] != last_tool else 0)
+            rest = best(loaded | (1 << i), sequence[-1] if sequence else last_tool)
+            if rest and (result is None or changes + rest[0] < result[0]):
+                result = (changes + rest[0], (i,) + rest[1])
+        return result
+
+    if len(templates) > 16:
+        return list(templates)
+    result = best(0, None)
+    return [templates[i] for i in result[1]] if result else list(templates)
+
+def occupancyProfile(intervals, start, resolution, bins):  # This function marks the bins along X that are covered by at least one interval.
+    # Each interval adds +1 where it starts and -1 where it ends, the running sum is the number of bodies over each bin.
+    if np is not None:
+        edges = np.array(intervals, dtype=float).reshape(-1, 2)
+        first = np.clip(np.floor((edges[:, 0] - start) / resolution), 0, bins).astype(int)
+        last = np.clip(np.ceil((edges[:, 1] - start) / resolution), 0, bins).astype(int)
+        steps = np.zeros(bins + 1)
+        np.add.at(steps, first, 1)
+        np.add.at(steps, last, -1)
+        return (np.cumsum(steps)[:bins] > 0).tolist()
+
+    steps = [0] * (bins + 1)
+    for low, high in intervals:
+        steps[min(max(int(math.floor((low - start) / resolution)), 0), bins)] += 1
+        steps[min(max(int(math.ceil((high - start) / resolution)), 0), bins)] -= 1
+    occupied, count = [], 0
+    for step in steps[:bins]:
+        count += step
+        occupied.append(count > 0)
+    return occupied
+
+def detectReturns(bodies, resolution=in_cm(1 / 16), threshold=in_cm(4), margin=in_cm(0.5)):  # This function finds the returns on the east and west sides of the panel from the frame and Exterior occupancy along X.
+    # A return is Exterior without frame behind it at the edge of the panel. Its width is measured from the edge of the
+    # Exterior to the first frame body and the gap is the part of that width where the Exterior is open as well.
+    # The sides without frame or with a width within the margin of the threshold are unsure.
+    result = {"east": False, "west": False, "eastWidth": None, "westWidth": None,
+              "eastGap": None, "westGap": None, "frame": False, "sure": False, "unsure": ["east", "west"]}
+    exterior = [b for b in bodies if b["name"] == "Exterior"]
+    frame = [b for b in bodies if b["name"].startswith(("Stud", "Track"))]
+    if not exterior or not frame:
+        return result
+
+    start = min(b["min"][0] for b in exterior)
+    bins = max(int(math.ceil((max(b["max"][0] for b in exterior) - start) / resolution)), 1)
+    exterior_profile = occupancyProfile([(b["min"][0], b["max"][0]) for b in exterior], start, resolution, bins)
+    frame_profile = occupancyProfile([(b["min"][0], b["max"][0]) for b in frame], start, resolution, bins)
+
+    framed = [i for i, occupied in enumerate(frame_profile) if occupied]
+    if not framed:
+        return result
+    result["frame"] = True
+
+    # The widths are measured from the exact extents, the profile only finds the open part of the Exterior.
+    widths = {
+        "west": max(min(b["min"][0] for b in frame) - start, 0.0),
+        "east": max(max(b["max"][0] for b in exterior) - max(b["max"][0] for b in frame), 0.0)
+    }
+    sides = {"west": range(0, framed[0]), "east": range(framed[-1] + 1, bins)}
+    for side, side_bins in sides.items():
+        result[side + "Width"] = widths[side]
+        result[side + "Gap"] = sum(1 for i in side_bins if not exterior_profile[i]) * resolution
+        result[side] = widths[side] > threshold
+    result["unsure"] = [side for side in ["east", "west"] if abs(widths[side] - threshold) <= margin]
+    result["sure"] = not result["unsure"]
+    return result
+
+def originPoints(corner, east_return, east_width):  # This function returns the Melvin (Point1) and Charles (Point2) WCS points from the back-top-right corner.
+    offset_x = corner[0] - in_cm(0.0625)
+    if east_return:
+        if east_width is not None:
+            offset_x = corner[0] - east_width
+        else:
+            offset_x = corner[0] - in_cm(4.6875)
+    return {
+        "Point1": [offset_x, corner[1] - in_cm(6.0), corner[2] - in_cm(0.0625)],
+        "Point2": [offset_x, corner[1], corner[2] - in_cm(0.0625)]
+    }
+
+def brickDetail(bodies):    # This function checks for faces within .5" of the farthest Y of the bodies.
+    tolerance_in = 0.5 * 2.54
+    min_y = float('-inf')
+    for body in bodies:
+        if body["min"][1] > min_y:
+            min_y = body["min"][1] * 2.54
+    return any(abs(min_y - body["min"][1] * 2.54) <= tolerance_in for body in bodies)
+
+def foamErrorMessage(foam, sheathing):  # This function compares the Foam and Sheathing dimensions to find errors from the Revit export.
+    foamLength, foamHeight = size(foam, 0), size(foam, 2)
+    sheathingLength, sheathingHeight = size(sheathing, 0), size(sheathing, 2)
+
+    tolerance = 1.0 * 2.54
+    diffLength = abs((foamLength - sheathingLength) / 2.54)
+    diffHeight = abs((foamHeight - sheathingHeight) / 2.54)
+
+    if diffLength <= 0.003 and diffHeight <= 0.003:
+        return None
+
+    alert_messages = []
+    if diffLength < tolerance:
+        alert_messages.append(f"X difference: {diffLength:.3f} inches")
+    if diffHeight < tolerance and diffHeight > 0.003:
+        alert_messages.append(f"Z difference: {diffHeight:.3f} inches")
+
+    if alert_messages:
+        message = "The dimension difference between 'Foam' and 'Sheathing' is less than 1 inch in the following directions:\n"
+        message += "\n".join(alert_messages)
+    else:
+        message = "\u2022 Difference between the 'Foam' and 'Sheathing' has been deteceted:\n"
+        if diffLength > 0.003:
+            message += f"       \u2022 X axis: {diffLength:.3f} inches"
+        if diffHeight > 0.003:
+            message += f"       \u2022 Z axis: {diffHeight:.3f} inches"
+    return message
+
+def charlesTemplates(has_bump, has_brick, east_return, west_return):  # This function lists the Charles templates in the order they are loaded.
+    templates = [
+        "Charles Facinghead",
+        "Charles Perimeter",
+        "Charles Perimeter Above Sheathing"
+    ]
+    if has_bump:
+        templates.append("Charles Bump Clean Up FM")
+    if has_brick:
+        templates.extend(["Charles Brick Feature EM", "Charles Brick Feature FM"])
+    if east_return or west_return:
+        templates.extend(return_templates)
+    return templates
+
+def setReturn(plan, side, has_return):  # This function updates the WCS points and Charles templates once the return of a side is known.
+    plan["return"][side] = has_return
+    east_return = plan["return"]["east"]
+    plan["wcs"] = originPoints(plan["wcsCorner"], east_return, plan["return"]["eastWidth"])
+    for setup in plan["setups"]:
+        if setup["name"] != "Charles":
+            continue
+        setup["templates"] = [t for t in setup["templates"] if t not in return_templates]
+        if east_return or plan["return"]["west"]:
+            setup["templates"].extend(return_templates)
+
+def parameterHandle(parameters, name, handles):  # This function looks up a parameter once and keeps the handle in the cache.
+    if name not in handles:
+        handles[name] = parameters.itemByName(name)
+    return handles[name]
+
+def applyParameters(parameters, values, handles):  # This function applies all values to a parameter collection in one pass and returns the ones that failed.
+    failed = []
+    for name, value in values.items():
+        try:
+            handle = parameterHandle(parameters, name, handles)
+            if handle is None:
+                failed.append(f"{name}: parameter not found")
+            elif isinstance(value, str):
+                handle.expression = value
+            else:
+                handle.value.value = value
+        except Exception as error:
+            failed.append(f"{name}: {error}")
+    return failed
+
+def stepTime(timings, name, start):  # This function adds the time (ms) since start to a step and returns the start of the next step.
+    now = time.perf_counter()
+    timings[name] = timings.get(name, 0) + (now - start) * 1000
+    return now
+
+def checkTemplates(plan, available):  # This function returns the planned templates that are missing from the template library listing.
+    return [template for setup in plan["setups"] for template in setup["templates"] if template not in available]
+
+def apiCallEstimate(plan):  # This function roughly estimates the Fusion API calls needed to apply a plan, from the plan alone.
+    calls = 2 if plan["rotation"] else 1                 # rotation and origin moves
+    calls += 8 + 2 * len(plan["stock"]["cuts"])          # stock copy, move, base feature, rename and clearance boxes
+    calls += len(plan["renames"])
+    calls += 5 * len(plan["cuts"])                        # sketch, rectangle, extrude input, extent and cut
+    calls += 5 * len(plan["wcs"])                         # sketch, sketch point, input, construction point and name
+    calls += 2 * max(len(plan["merge"]) - 1, 0)           # combine input and combine
+    for setup in plan["setups"]:
+        calls += 12 + len(setup["templates"])             # setup, machine, stock, WCS parameters and templates
+        if setup["stockMode"] == "box":
+            calls += 6                                    # box size and position parameters instead of the stock body
+        calls += 2 * len(setup["entryPoints"])
+        calls += sum(1 + len(parameters) for parameters in setup["operations"].values())
+    return calls
+
+# Body names the script gives the bodies, a panel that already has them has been prepared before.
+prepared_names = ["Exterior", "Stock", "Sheathing", "Foam", "Stud", "Track", "Bump"]
+
+# Expected Exterior thickness (inches) and how far a body may reach past the Exterior before it is reported.
+exterior_thickness_range = (6.5, 12.0)
+extents_tolerance = 1.0
+
+def preflight(snapshot):    # This function checks a snapshot of the bodies before anything is changed and lists every problem found.
+    # Errors stop the script, warnings are shown so the user can stop before the design is changed.
+    errors, warnings = [], []
+    if not snapshot:
+        return {"errors": ["The design has no bodies."], "warnings": []}
+
+    names = [body["name"] for body in snapshot]
+    exterior = next((body for body in snapshot if body["name"] == "Body1"), None)
+    if not exterior:
+        errors.append("\"Body1\" could not be found: The Exterior body is the first body of the Revit export.")
+    prepared = sorted({name for name in names for prepared_name in prepared_names if name.startswith(prepared_name)})
+    if prepared:
+        errors.append(f"The panel has already been prepared: {', '.join(prepared)} found.")
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        warnings.append(f"Body names are used more than once: {', '.join(duplicates)}.")
+
+    # Component counts by thickness.
+    counts = {name: 0 for name in ["Sheathing", "Foam", "Stud", "Track"]}
+    for body in snapshot:
+        for name, target in [("Sheathing", sheathing_thickness), ("Foam", foam_thickness),
+                             ("Stud", stud_thickness), ("Track", track_thickness)]:
+            if abs(thickness(body) - in_cm(target)) < in_cm(0.01):
+                counts[name] += 1
+    if counts["Sheathing"] == 0:
+        warnings.append(f"No {sheathing_thickness}\" sheathing bodies were found: The Melvin setup will not be created.")
+    elif counts["Sheathing"] == 1:
+        warnings.append("Only one sheathing body was found: It is not renamed, so the Melvin setup will not be created.")
+    if counts["Foam"] > 1:
+        warnings.append(f"{counts['Foam']} foam bodies were found: Only the first is compared with the sheathing.")
+    if counts["Stud"] + counts["Track"] == 0:
+        warnings.append("No stud or track bodies were found: The return will have to be confirmed.")
+
+    # Model extents.
+    if exterior:
+        exterior_width = thickness(exterior) / 2.54
+        if counts["Foam"] == 0 and exterior_width <= 6.9:
+            warnings.append("No foam body was found and the panel is not thicker than 6.9\": The Charles setup will not be created.")
+        if not exterior_thickness_range[0] <= exterior_width <= exterior_thickness_range[1]:
+            warnings.append(f"\"Body1\" is {exterior_width:.3f}\" thick, expected {exterior_thickness_range[0]}\" to "
+                            f"{exterior_thickness_range[1]}\": Check the front face selection.")
+        # A bump is expected to reach past the Exterior.
+        tolerance = in_cm(extents_tolerance)
+        outside = [body["name"] for body in snapshot if not isBump(body)
+                   and any(body["min"][a] < exterior["min"][a] - tolerance or body["max"][a] > exterior["max"][a] + tolerance for a in range(3))]
+        if outside:
+            warnings.append(f"Bodies reach more than {extents_tolerance}\" past \"Body1\": {', '.join(outside)}.")
+    empty = [body["name"] for body in snapshot if min(size(body, axis) for axis in range(3)) <= 0]
+    if empty:
+        errors.append(f"Bodies have no volume: {', '.join(empty)}.")
+    return {"errors": errors, "warnings": warnings}
+
+def sisterKey(bodies):      # This function hashes the rounded extents and roles of the planned bodies, panels with the same key have the same geometry.
+    # The body number of the bodies that were not identified is left out, it depends on the order of the Revit export.
+    entries = sorted([re.sub(r'\d+$', '', body["name"]), [round(value, 2) + 0.0 for value in body["min"] + body["max"]]]
+                     for body in bodies)
+    return hashlib.sha1(json.dumps(entries).encode("utf-8")).hexdigest()
+
+def buildPlan(snapshot, document_name, rotation=None, library_templates=None):  # This function plans the whole run from a snapshot of the bodies without changing the design.
+    # The snapshot is a list of {"name", "min", "max", "thickness"} bodies (cm) in the order of the bodies in the root component,
+    # already rotated to the front view. The rotation is only recorded so the plan can be applied.
+    # library_templates is the optional listing of the template library used to check the planned templates.
+    start = time.perf_counter()
+    step = start
+    timings = {}
+    panel = panelNumber(document_name)
+    plan = {
+        "document": document_name,
+        "panel": panel,
+        "units": "cm",
+        "rotation": rotation,
+        "translation": None,
+        "stock": None,
+        "renames": [],
+        "cuts": [],
+        "merge": [],
+        "bump": None,
+        "return": {"east": False, "west": False, "ask": False},
+        "wcsCorner": None,
+        "wcs": {},
+        "setups": [],
+        "collisions": [],
+        "valid": False,
+        "warnings": [],
+        "messages": [],
+        "timings": timings,
+        "apiCalls": 0
+    }
+
+    bodies = [{"index": i, "name": b["name"], "min": list(b["min"]), "max": list(b["max"]), "thickness": b.get("thickness"),
+               "volume": b.get("volume")} for i, b in enumerate(snapshot)]
+
+    # Move all bodies so the back-top-right corner of 'Body1' is at the origin.
+    exterior = next((b for b in bodies if b["name"] == "Body1"), None)
+    if not exterior:
+        plan["warnings"].append("\"Body1\" could not be found: The panel could not be planned.")
+        return plan
+    plan["translation"] = [-value for value in exterior["max"]]
+    for body in bodies:
+        translateBody(body, plan["translation"])
+    exterior["name"] = "Exterior"
+    plan["valid"] = True
+    step = stepTime(timings, "origin", step)
+
+    # Stock is a copy of the Exterior added after the existing bodies.
+    stock = {"index": len(bodies), "name": "Stock", "min": list(exterior["min"]), "max": list(exterior["max"]),
+             "thickness": exterior["thickness"], "volume": exterior["volume"]}
+    translateBody(stock, stock_offsets[stock_machine])
+    bodies.append(stock)
+    plan["stock"] = {"source": exterior["index"], "machine": stock_machine, "offset": stock_offsets[stock_machine], "cuts": []}
+    step = stepTime(timings, "stock", step)
+
+    identifyThickness(bodies, foam_thickness, "Foam")
+    has_foam = any("Foam" in b["name"] for b in bodies)
+    step = stepTime(timings, "identify", step)
+
+    plan["bump"] = identifyBump(bodies)
+    if plan["bump"]:
+        cuts = bumpCuts(bodies, plan["bump"], has_foam)
+        for cut in cuts:
+            for body in bodies:
+                if body["name"] == cut["body"]:
+                    cutBody(body, cut)
+
+        # The Stock cuts are made while the Stock body is built, only the other bodies are cut in the timeline.
+        plan["stock"]["cuts"] = [cut for cut in cuts if cut["body"] == "Stock"]
+        plan["cuts"] = [cut for cut in cuts if cut["body"] != "Stock"]
+        plan["messages"].append("A bump has been detected. Adjust toolpaths accordingly.")
+    step = stepTime(timings, "bump", step)
+
+    identifyThickness(bodies, stud_thickness, "Stud")
+    identifyThickness(bodies, track_thickness, "Track")
+    step = stepTime(timings, "identify", step)
+
+    returns = detectReturns(bodies)
+    plan["return"].update(returns)
+    plan["return"]["ask"] = not returns["sure"]
+    if not returns["frame"]:
+        plan["messages"].append("Frame bodies could not be found.")
+    elif not returns["sure"]:
+        sides = " and ".join({"east": "right", "west": "left"}[side] for side in returns["unsure"])
+        plan["messages"].append(f"The return detection was unsure about the return width on the {sides} hand side.")
+    east_return, west_return = returns["east"], returns["west"]
+    step = stepTime(timings, "returns", step)
+
+    # The WCS points are measured from the first body in the root component.
+    plan["wcsCorner"] = list(bodies[0]["max"])
+    plan["wcs"] = originPoints(plan["wcsCorner"], east_return, returns["eastWidth"])
+    step = stepTime(timings, "wcs", step)
+
+    # Merge all sheathing panels into one.
+    sheathing = [b for b in bodies if abs(thickness(b) - in_cm(sheathing_thickness)) < in_cm(0.01)]
+    sheathing_box = bool(sheathing) and fillsBox(sheathing)
+    if len(sheathing) > 1:
+        plan["merge"] = [b["index"] for b in sheathing]
+        merged_min, merged_max = unionExtents(sheathing)
+        merged_volume = sum(b["volume"] for b in sheathing) if all(b["volume"] is not None for b in sheathing) else None
+        sheathing[0].update({"name": "Sheathing", "min": merged_min, "max": merged_max, "thickness": None, "volume": merged_volume})
+        bodies = [b for b in bodies if b not in sheathing[1:]]
+
+    for body in bodies:
+        original = snapshot[body["index"]]["name"] if body["index"] < len(snapshot) else None
+        if body["name"] != original and body["index"] != stock["index"]:
+            plan["renames"].append({"index": body["index"], "from": original, "to": body["name"]})
+    step = stepTime(timings, "merge", step)
+
+    # Melvin setup.
+    if any("Sheathing" in b["name"] for b in bodies):
+        plan["setups"].append({
+            "name": "Melvin",
+            "machine": "Melvin",
+            "machineLibrary": "local",
+            "programName": panel + "M",
+            "parameters": dict({"job_programName": f"'{panel}M'"}, **setup_parameters),
+            "stock": "Sheathing",
+            "stockMode": "solid",
+            "origin": "Point1",
+            "templates": ["Melvin 2 Pass NEW"],
+            "entryPoints": {"Perimeter": "Point1"},
+            "operations": {}
+        })
+    else:
+        plan["messages"].append("\"Sheathing\" body could not be found: The Melvin setup will not be created.")
+
+    # Charles setup. Panels thicker than 6.9" have foam even if the Foam body is missing.
+    exterior_width = thickness(exterior) / 2.54
+    has_bump = any("Bump" in b["name"] for b in bodies)
+    if has_foam or exterior_width > 6.9:
+        operations = {}
+        if plan["bump"]:
+            operations["Facinghead"] = {
+                "passAngle": "0 deg" if plan["bump"] == "east" else "180 deg",
+                "transitionType": "'straight-line'"
+            }
+        templates = charlesTemplates(has_bump, brickDetail(bodies), east_return, west_return)
+
+        # Thin foam, lower the facinghead and brick feature cutting heights.
+        if exterior_width > 6.9 and exterior_width < 9.25:
+            operations.setdefault("Facinghead", {}).update({
+                "bottomHeight_offset": "8.25 in",
+                "topHeight_offset": "8.5 in"
+            })
+            for name in ["Brick Feature EM", "Brick Feature FM"]:
+                if "Charles " + name in templates:
+                    operations[name] = {"bottomHeight_offset": "7.75 in"}
+
+        plan["setups"].append({
+            "name": "Charles",
+            "machine": "Charles",
+            "machineLibrary": "cloud",
+            "programName": panel + "C",
+            "parameters": dict({"job_programName": f"'{panel}C'"}, **setup_parameters),
+            "stock": "Stock",
+            "stockMode": "solid",
+            "origin": "Point2",
+            "templates": templates,
+            "entryPoints": {},
+            "operations": operations
+        })
+    else:
+        plan["messages"].append("\"Foam\" body could not be found: The Charles setup will not be created.")
+
+    step = stepTime(timings, "setups", step)
+
+    # Use a box stock where the solid stock is a plain box: rectangular sheathing for Melvin, and for Charles a Stock body
+    # without bump cuts or returns.
+    box_setups = {
+        "Melvin": sheathing_box,
+        "Charles": not plan["stock"]["cuts"] and not east_return and not west_return and not plan["return"]["ask"]
+                   and fillsBox([exterior])
+    }
+    for setup in plan["setups"]:
+        stock_body = next((b for b in bodies if b["name"] == setup["stock"]), None)
+        if box_stock and stock_body and box_setups.get(setup["name"]):
+            setup["stockMode"] = "box"
+            setup["parameters"].update(boxStockParameters(stock_body, bodies[0]))
+    step = stepTime(timings, "boxStock", step)
+
+    # Check the facinghead sweep against the bodies before any toolpath is generated.
+    charles = next((setup for setup in plan["setups"] if setup["name"] == "Charles"), None)
+    if charles and "Charles Facinghead" in charles["templates"]:
+        plan["collisions"] = facingheadCollisions(bodies, stock, charles["operations"].get("Facinghead", {}), plan["wcs"]["Point2"][1])
+        for collision in plan["collisions"]:
+            plan["warnings"].append(f"The facinghead {collision['box']} would hit \"{collision['body']}\": "
+                                    f"The Charles Facinghead toolpath will not be generated.")
+    step = stepTime(timings, "collisions", step)
+
+    if library_templates is not None:
+        for template in checkTemplates(plan, library_templates):
+            plan["warnings"].append(f"Template \"{template}\" could not be found in the template library.")
+    step = stepTime(timings, "setups", step)
+
+    # Compare Foam and Sheathing dimensions to find errors from the Revit export.
+    if has_foam:
+        foam = next((b for b in bodies if b["name"] == "Foam"), None)
+        sheathing_body = next((b for b in bodies if b["name"] == "Sheathing"), None)
+        if not foam:
+            plan["messages"].append('"Foam" body could not be found: Error Dectection could not be evaluated.')
+        elif not sheathing_body:
+            plan["messages"].append('"Sheathing" body could not be found: Error Dectection could not be evaluated.')
+        else:
+            message = foamErrorMessage(foam, sheathing_body)
+            if message:
+                plan["warnings"].append(message)
+    step = stepTime(timings, "foamCheck", step)
+
+    plan["apiCalls"] = apiCallEstimate(plan)
+    plan["bodies"] = bodies
+    plan["sisterKey"] = sisterKey(bodies)
+    plan["planTime"] = round((time.perf_counter() - start) * 1000, 3)
+    return plan
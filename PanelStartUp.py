@@ -1,118 +1,744 @@
-import adsk.core, adsk.fusion, math, re, subprocess, os, time, webbrowser, json, traceback
+import adsk.core, adsk.fusion, adsk.cam, math, subprocess, os, time, webbrowser, json, traceback, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from . import PanelLogic, ShiftPlanner, BIMCache, NCValidator, NCCompactor
 
 # TODO: Create a way to determine if the panel has foam without relying on the the 3.0" foam model as it may not always be available. To charles or not?
 # TODO: Create test to find errors in sheathing compared to the frame.
 # TODO: Create script to automate cutting the "L" shape notches in the back of the sheathing.
 # TODO: Identify foam under windows and if so add tool path for window bevel.
 
-# Array to display all warning messages at the end of the script.  
-report_message = []
+# NC post settings. The output folder and post-processors must be adjusted for your environment.
+post_output_folder = r"C:\Users\ahughes\Documents\NC Programs"
+post_processors = {
+    "Melvin": "melvin linuxcnc.cps",
+    "Charles": "charles linuxcnc.cps"
+}
+
+# Posted programs are compacted (collinear moves merged, arcs fitted) within the tolerance in inches. With verify on,
+# a program is only replaced when the compacted path stays within the tolerance of the posted one.
+compact_programs = True
+compact_tolerance = 0.001
+compact_verify = True
+
+# Cycle time estimate settings per machine, rapid feed in cm/min and tool change time in seconds.
+# The cycle times of each panel are appended to the shift log used by ShiftPlanner.py.
+machine_times = {
+    "Melvin": {"rapidFeed": 500.0, "toolChange": 15.0},
+    "Charles": {"rapidFeed": 500.0, "toolChange": 15.0}
+}
+shift_log = r"C:\Users\ahughes\Documents\NC Programs\Panel Shift Log.csv"
+
+# BIM metadata cache. The prefetcher fills it for the open panel documents from the BIM export and the local stand-in
+# service ({panel} is replaced by the panel number), the fields listed in bim_summary_fields are shown in the summary.
+bim_cache = r"C:\Users\ahughes\Documents\Python BIM\bim_cache.sqlite"
+bim_export_file = r"C:\Users\ahughes\Documents\Python BIM\panels.csv"
+bim_service_url = "http://localhost:8765/panels/{panel}"
+bim_summary_fields = ["Status", "Level", "Grid", "Ship Date"]
+
+# Run mode: "full" plans and changes the design, "plan" only saves the plan (dry run) and "apply" executes a saved plan.
+run_mode = "full"
+plan_folder = r"C:\Users\ahughes\Documents\Panel Plans"
+
+# Average toolpath generation time of each operation with solid and box stock, compared in the summary.
+stock_times = r"C:\Users\ahughes\Documents\Panel Plans\stock_times.json"
+
+# Tool numbers of the operations of each template, recorded whenever a template is loaded.
+template_tools_file = r"C:\Users\ahughes\Documents\Panel Plans\template_tools.json"
+
+# Index of the processed panels by geometry, used to offer cloning the setups and toolpaths of a sister panel.
+sister_index = r"C:\Users\ahughes\Documents\Panel Plans\sister_index.json"
+raw_suffix = " raw"         # The unprocessed file of a cloned panel is renamed with this suffix so the clone replaces it.
+
+# Geometry prep mode: "history" records every prep feature in the timeline, "group" collapses them into one timeline group
+# and "direct" runs the prep without history. "direct" removes the existing timeline of the panel document and turns
+# history back on before the CAM setups are created.
+prep_mode = "group"
+
+# Add-in mode registers a toolbar command and keeps the session caches warm between panels.
+# PanelStartUp.manifest must have "type": "addin" for Fusion to load the script as an add-in.
+addin_mode = False
+command_id = "PanelStartUpCommand"
+run_event_id = "PanelStartUpRunEvent"
+
+# Queue mode runs every open panel document, or only the panels listed in queue_documents, and shows one summary.
+# Listed panels that are not open are opened from the active project. The front face chosen for the panels of a project is
+# remembered in front_directions and reused without asking once it has been the same for every panel of that project.
+queue_mode = False
+queue_documents = []        # Panel numbers, e.g. ["1234", "1235"], empty runs every open panel document.
+queue_command_id = "PanelStartUpQueueCommand"
+queue_event_id = "PanelStartUpQueueEvent"
+front_directions = r"C:\Users\ahughes\Documents\Panel Plans\front_directions.json"
+
+# Session state, kept for as long as the script or add-in is loaded.
+libraries = None            # Machine and template library listings.
+mesh_cache = {}             # Coarse body meshes by body entity token, dropped when the body revision changes or the body is gone.
+template_tools = {}         # Tool numbers of the operations of each template, read from template_tools_file once per session.
+machine_items = {}          # Machines by library and model, found once per session.
+bim_process = None          # The pyBIM process and the panel it was opened for.
+bim_panel = None
+bim_prefetch = None         # Background thread filling the BIM cache.
+analysis_pool = None        # Worker thread for the pure-Python panel analysis.
+handlers = []               # Event handlers must be referenced for as long as the add-in runs.
+queue_summary = None        # Summaries of the queued panels, None when a single panel is run.
+ctx = None                  # State of the current run.
+
+class PanelRun:             # This class holds the state of one run so nothing leaks from one panel to the next.
+    def __init__(self):
+        self.design = adsk.fusion.Design.cast(app.activeDocument.products.itemByProductType("DesignProductType"))
+        self.rootComp = self.design.rootComponent
+        self.plan = None
+        self.report_message = []        # Array to display all warning messages at the end of the script.
+        self.toolpath_queue = []        # Operations waiting for toolpath generation.
+        self.toolpath_jobs = []         # Toolpath generation jobs that have been started.
+        self.parameter_handles = {}     # Parameter handles by setup or "setup - operation" name, each is only looked up once.
+        self.cam = None
+        self.setups = None
+        self.camOcc = None
+        self.timeline_start = 0         # Timeline position before the geometry prep.
+        self.prep_start = None
+        self.details = []               # Timing and BIM lines shown at the end of the summary.
+        self.bim = None                 # Cached BIM fields of the panel.
+        self.summary = None             # Summary text, shown at the end or collected by the queue.
 
 def run(context):
     # Set global variables
-    global app, ui, product, design, rootComp
+    global app, ui
 
     app = adsk.core.Application.get()
     ui = app.userInterface
-    product = app.activeProduct
-    design = adsk.fusion.Design.cast(product)
-    rootComp = design.rootComponent
-    
-    # list of functions 
+
+    if addin_mode:
+        startAddIn()
+    elif queue_mode:
+        runQueue()
+        shutdownAnalysisPool()
+    else:
+        runPanel()
+        shutdownAnalysisPool()
+
+def stop(context):
+    if addin_mode:
+        stopAddIn()
+
+def startAddIn():           # This function adds the Panel Start Up and Panel Queue commands to the Scripts and Add-Ins panel.
+    try:
+        commands = [
+            (command_id, "Panel Start Up", "Prepares the panel and creates the Melvin and Charles setups.", run_event_id, runPanel),
+            (queue_command_id, "Panel Queue", "Runs Panel Start Up on every open panel document with one summary.",
+             queue_event_id, runQueue)
+        ]
+        toolbarPanel = ui.allToolbarPanels.itemById("SolidScriptsAddinsPanel")
+        for cmd_id, name, tooltip, event_id, function in commands:
+            cmdDef = ui.commandDefinitions.itemById(cmd_id)
+            if not cmdDef:
+                cmdDef = ui.commandDefinitions.addButtonDefinition(cmd_id, name, tooltip)
+            onCommandCreated = CommandCreatedHandler(event_id)
+            cmdDef.commandCreated.add(onCommandCreated)
+            handlers.append(onCommandCreated)
+
+            # selectEntity cannot be used inside a command, so the command fires an event that runs the panel after it ends.
+            runEvent = app.registerCustomEvent(event_id)
+            onRun = RunEventHandler(function)
+            runEvent.add(onRun)
+            handlers.append(onRun)
+
+            if not toolbarPanel.controls.itemById(cmd_id):
+                toolbarPanel.controls.addCommand(cmdDef)
+    except:
+        ui.messageBox(f"startAddIn(): failed:\n{traceback.format_exc()}")
+
+def stopAddIn():            # This function removes the commands and releases the session state.
+    try:
+        toolbarPanel = ui.allToolbarPanels.itemById("SolidScriptsAddinsPanel")
+        for cmd_id, event_id in [(command_id, run_event_id), (queue_command_id, queue_event_id)]:
+            control = toolbarPanel.controls.itemById(cmd_id)
+            if control:
+                control.deleteMe()
+            cmdDef = ui.commandDefinitions.itemById(cmd_id)
+            if cmdDef:
+                cmdDef.deleteMe()
+            app.unregisterCustomEvent(event_id)
+        handlers.clear()
+        shutdownAnalysisPool()
+    except:
+        ui.messageBox(f"stopAddIn(): failed:\n{traceback.format_exc()}")
+
+class CommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
+    def __init__(self, event_id):
+        super().__init__()
+        # One execute handler is shared by every click, so the handlers do not grow during the session.
+        self.onExecute = CommandExecuteHandler(event_id)
+
+    def notify(self, args):
+        args.command.execute.add(self.onExecute)
+
+class CommandExecuteHandler(adsk.core.CommandEventHandler):
+    def __init__(self, event_id):
+        super().__init__()
+        self.event_id = event_id
+
+    def notify(self, args):
+        app.fireCustomEvent(self.event_id)
+
+class RunEventHandler(adsk.core.CustomEventHandler):
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+
+    def notify(self, args):
+        try:
+            self.function()
+        except:
+            ui.messageBox(f"{self.function.__name__}(): failed:\n{traceback.format_exc()}")
+
+def analysisPool():         # This function returns the worker pool, created once per session.
+    global analysis_pool
+    if analysis_pool is None:
+        analysis_pool = ThreadPoolExecutor(max_workers=1)
+    return analysis_pool
+
+def shutdownAnalysisPool():  # This function stops the worker pool if it was created.
+    global analysis_pool
+    if analysis_pool is not None:
+        analysis_pool.shutdown()
+        analysis_pool = None
+
+def runPanel():             # This function runs the script on the active panel document.
+    global ctx
+    ctx = PanelRun()
+    pruneMeshCache()        # Drops the meshes of the bodies of panels that are no longer active.
+    prefetchBIM()           # Fills the BIM cache for the open panel documents while the panel is planned.
+
+    # A panel processed before keeps its setups, only the toolpaths that changed are generated and posted again.
+    if run_mode != "plan" and regeneratePanel():
+        return
+
+    # Plan the run from a read-only snapshot of the bodies, or load a saved plan.
+    if run_mode == "apply":
+        loadPlan()
+    else:
+        planPanel()
+    if not ctx.plan:
+        return
+    if run_mode == "plan":
+        savePlan()
+        return
+
+    if cloneSister():
+        return
+
+    for message in ctx.plan["messages"]:
+        addMessage(message)
+
+    # list of functions
+    openBIM()               # Opens BIM in the browser.
+    isReturn()              # Asks if there is a return on the right side of the panel when the return detection is unsure.
+    startPrep()             # Turns off history for the geometry prep when it runs in direct mode.
     rotateBodiesToFront()    # Rotates the bodies around the Z axis so the front of the panel is the front view.
     moveBodiesToOrgin()     # Moves all bodies to the origin.
     stockBody()             # Create a stock body for Charles setup.
     changeUnits()           # Change units to inches.
-    identifyFoam()          # Identify and rename foam bodies.
-    identifyBump()          # Identify and rename bump bodies.
-    identifyStuds()         # Identify and rename stud bodies.
-    identifyTrack()         # Identify and rename track bodies.
-    openBIM()               # Opens BIM in the browser.
-    isReturn()              # Is there a return on the right side of the panel that would interfer with WCS?
-    melvinOrgin()           # Creates a sketch and contruction point for the Melvin WCS.
-    charlesOrgin()          # Creates a sketch and contruction point for the Charles WCS.
+    identifyBodies()        # Rename the Exterior, Foam, Bump, Stud and Track bodies.
+    bumpCuts()              # Cut the Stock and Foam bodies so the facinghead does not cut the bump.
+    wcsOrigins()            # Creates the sketches and contruction points for the Melvin and Charles WCS.
     mergeSheathin()         # Merge all sheathing panels into one.
+    finishPrep()            # Groups the geometry prep features in the timeline or turns history back on.
     camWorkspace()          # Create the cam workspace.
-    melvinSetup()           # Create the Melvin setup.
-    charlesSetup()          # Create the Charles setup.
-    thinFoam()              # Checks for thin foam and adjusts the facemill cutting height along with Brick Feature EM and FM cutting heights if they exist.
+    createSetups()          # Create the Melvin and Charles setups and apply the planned toolpath changes.
+    prepTime()              # Records the time from the start of the geometry prep to the setups.
+    startToolpaths()        # Starts generating the queued toolpaths in the background now that the setups are final.
     foamErrorDetection()    # Compare Foam and Sheathing X, Y, and Z dimensions to find errors from Revit export.
+    waitForToolpaths()      # Shows toolpath generation progress per operation until all generation is done.
+    stockTimes()            # Compares the toolpath generation time with the box and solid stock of earlier panels.
+    cycleTimes()            # Totals the estimated cycle time per machine and appends it to the shift log.
+    postPrograms()          # Posts the Melvin and Charles programs that have changed since the last post.
+    recordSister()          # Adds the panel to the sister panel index so panels with the same geometry can reuse it.
     showAllMessages()       # Displays a summary at the end of the script.
 
-def addMessage(msg):        # This function adds messages throughout the script to give a summary at the end.
+def queueDocuments():       # This function returns the panel documents to run in queue mode and the listed panels that could not be found.
+    documents = [document for document in app.documents if document.products.itemByProductType("DesignProductType")]
+    if not queue_documents:
+        return documents, []
+
+    # Listed panels that are not open are looked for in every folder of the active project.
+    by_panel = {PanelLogic.panelNumber(document.name): document for document in documents}
+    folders = [app.data.activeProject.rootFolder]
+    while folders and any(panel not in by_panel for panel in queue_documents):
+        folder = folders.pop()
+        for dataFile in folder.dataFiles:
+            panel = PanelLogic.panelNumber(dataFile.name)
+            if panel in queue_documents and panel not in by_panel:
+                by_panel[panel] = app.documents.open(dataFile)
+        folders.extend(folder.dataFolders)
+    missing = [panel for panel in queue_documents if panel not in by_panel]
+    return [by_panel[panel] for panel in queue_documents if panel in by_panel], missing
+
+def runQueue():             # This function runs the script on every queued panel document and shows one summary.
+    global queue_summary
     try:
-        report_message.append(f"\u2022 {msg}\n")
+        documents, missing = queueDocuments()
+        missing_text = f"Listed panels that could not be found in {app.data.activeProject.name}: {', '.join(missing)}" if missing else ""
+        if not documents:
+            ui.messageBox("\n\n".join(filter(None, ["No panel documents to run.", missing_text])))
+            return
+
+        queue_summary = []
+        queue_start = time.perf_counter()
+        for document in documents:
+            document.activate()
+            document_name = document.name       # A cloned sister panel closes the document.
+            start = time.perf_counter()
+            try:
+                runPanel()
+                summary = ctx.summary or "Stopped before the summary."
+            except:
+                summary = f"runPanel(): failed:\n{traceback.format_exc()}"
+            queue_summary.append(f"{document_name} ({time.perf_counter() - start:.1f} s)\n{summary}")
+
+        full_message = "\n\n".join(queue_summary)
+        full_message += f"\n\n{len(documents)} panels in {time.perf_counter() - queue_start:.1f} s"
+        if missing_text:
+            full_message += f"\n\n{missing_text}"
+        ui.messageBox(full_message, "Queue Summary",
+                      adsk.core.MessageBoxButtonTypes.OKButtonType,
+                      adsk.core.MessageBoxIconTypes.InformationIconType)
     except:
-        ui.messageBox(f"addMessage(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"runQueue(): failed:\n{traceback.format_exc()}")
+    finally:
+        queue_summary = None
 
-def in_cm(x):               # This function converts inches to cm.
-    return x * 2.54
+def regeneratePanel():      # This function regenerates and posts the changed toolpaths of a panel processed before, True if the panel has setups.
+    try:
+        cam = adsk.cam.CAM.cast(app.activeDocument.products.itemByProductType('CAMProductType'))
+        processed = [setup for setup in cam.setups if setup.name in post_processors] if cam else []
+        if not processed:
+            return False
+
+        camWorkspace()
+        addMessage("The panel has been processed before: Only the toolpaths that changed were generated.")
+        for setup in processed:
+            for operation in setup.allOperations:
+                queueToolpath(operation)
+        startToolpaths()
+        waitForToolpaths()
+        stockTimes()
+        cycleTimes()
+        postPrograms()
+        showAllMessages()
+        return True
+    except:
+        ui.messageBox(f"regeneratePanel(): failed:\n{traceback.format_exc()}")
+        return True
 
-def rotateBodiesToFront():
+def addMessage(msg):        # This function adds messages throughout the script to give a summary at the end.
     try:
+        ctx.report_message.append(f"\u2022 {msg}\n")
+    except:
+        ui.messageBox(f"addMessage(): failed:\n{traceback.format_exc()}")
+
+def frontRotation():        # This function asks for the front face and returns the rotation to the front view, False if the script should stop.
+    project = projectName() if queue_summary is not None else None
+    current_normal = rememberedFront(project)
+    if current_normal is None:
         # Ask the user to select a face
         selection = ui.selectEntity('Select a face to be the new front view.', 'Faces')
         if not selection:
             ui.messageBox("No face selected. Script stopped.")
-            return
+            return False
 
         face = selection.entity
         if not isinstance(face, adsk.fusion.BRepFace):
             ui.messageBox("Selected entity is not a valid BRepFace. Script stopped.")
-            return
+            return False
 
         # Get the normal vector of the face at its centroid
         success, current_normal = face.evaluator.getNormalAtPoint(face.centroid)
         if not success:
             ui.messageBox("Failed to get face normal. Script stopped.")
-            return
+            return False
         current_normal.normalize()
+        if project:
+            recordFront(project, current_normal)
+    else:
+        addMessage(f"Front face taken from the earlier panels of {project}")
+
+    # Define target normal (global negative Y)
+    target_normal = adsk.core.Vector3D.create(0, -1, 0)
+
+    # Compute rotation axis (perpendicular to both)
+    rotation_axis = current_normal.crossProduct(target_normal)
+
+    # Check for edge cases: already aligned or exactly opposite
+    if rotation_axis.length < 1e-6:
+        dot = current_normal.dotProduct(target_normal)
+        if dot > 0:
+            if queue_summary is None:
+                ui.messageBox("Face is already aligned with target. No rotation needed.")
+            return None
+        else:
+            # Opposite direction: rotate 180 degrees around global Z
+            rotation_axis = adsk.core.Vector3D.create(0, 0, 1)
+            angle = math.pi
+    else:
+        rotation_axis.normalize()
+        # Rotation angle
+        dot = max(-1.0, min(1.0, current_normal.dotProduct(target_normal)))
+        angle = math.acos(dot)
+
+    # Compute rotation origin (center of the root component)
+    bbox = ctx.rootComp.boundingBox
+    rotation_origin = adsk.core.Point3D.create(
+        (bbox.minPoint.x + bbox.maxPoint.x) / 2.0,
+        (bbox.minPoint.y + bbox.maxPoint.y) / 2.0,
+        (bbox.minPoint.z + bbox.maxPoint.z) / 2.0
+    )
+
+    # Create transformation matrix
+    transform = adsk.core.Matrix3D.create()
+    transform.setToRotation(angle, rotation_axis, rotation_origin)
+    return list(transform.asArray())
+
+def projectName():          # This function returns the project of the active document, None if it has not been saved.
+    dataFile = app.activeDocument.dataFile
+    return dataFile.parentProject.name if dataFile else None
+
+def loadFrontDirections():  # This function reads the front face directions chosen per project.
+    if not os.path.exists(front_directions):
+        return {}
+    with open(front_directions, "r") as json_file:
+        return json.load(json_file)
+
+def rememberedFront(project):  # This function returns the front face normal of the project when every earlier panel used it and it fits this panel.
+    if not project:
+        return None
+    remembered = loadFrontDirections().get(project)
+    if not remembered or not remembered["consistent"] or remembered["panels"] < 2:
+        return None
+
+    # The largest plane of "Body1" has to face that way, checked on the cached mesh the snapshot reuses. A panel whose
+    # front and back are the same size cannot tell them apart, so the face is asked for.
+    exterior = ctx.rootComp.bRepBodies.itemByName("Body1")
+    if PanelLogic.np is None or not exterior:
+        return None
+    normal = PanelLogic.largestPlaneNormal(*bodyMesh(exterior))
+    if normal is None or sum(a * b for a, b in zip(normal, remembered["normal"])) < 0.999:
+        return None
+    return adsk.core.Vector3D.create(*remembered["normal"])
+
+def recordFront(project, normal):  # This function records the front face chosen for a panel of the project.
+    try:
+        directions = loadFrontDirections()
+        chosen = [normal.x, normal.y, normal.z]
+        remembered = directions.get(project)
+        if remembered is None:
+            directions[project] = {"normal": chosen, "consistent": True, "panels": 1}
+        else:
+            same = sum(a * b for a, b in zip(remembered["normal"], chosen)) >= 0.999
+            remembered["consistent"] = remembered["consistent"] and same
+            remembered["panels"] += 1
+        os.makedirs(os.path.dirname(front_directions), exist_ok=True)
+        with open(front_directions, "w") as json_file:
+            json.dump(directions, json_file, indent=4)
+    except:
+        ui.messageBox(f"recordFront(): failed:\n{traceback.format_exc()}")
+
+def pruneMeshCache():       # This function keeps only the meshes of the bodies of the active panel.
+    tokens = {body.entityToken for body in ctx.rootComp.bRepBodies}
+    for token in [token for token in mesh_cache if token not in tokens]:
+        del mesh_cache[token]
+
+def bodyMesh(body):         # This function returns the coarse triangle mesh of a body as vertex and triangle arrays.
+    cached = mesh_cache.get(body.entityToken)
+    if cached and cached["revision"] == body.revisionId:
+        return cached["vertices"], cached["triangles"]
+
+    calculator = body.meshManager.createMeshCalculator()
+    calculator.setQuality(adsk.fusion.TriangleMeshQualityOptions.LowQualityTriangleMesh)
+    mesh = calculator.calculate()
+    vertices, triangles = PanelLogic.meshArrays(mesh.nodeCoordinatesAsDouble, mesh.nodeIndices)
+    mesh_cache[body.entityToken] = {"revision": body.revisionId, "vertices": vertices, "triangles": triangles}
+    return vertices, triangles
+
+def snapshotBodies(rotation=None):  # This function reads the name, extents and thickness of every body in the root component, rotated to the front view.
+    snapshot = []
+    for body in ctx.rootComp.bRepBodies:
+        if PanelLogic.np is not None:
+            vertices, triangles = bodyMesh(body)
+            if rotation:
+                vertices = PanelLogic.transformVertices(vertices, rotation)
+            min_point, max_point = PanelLogic.meshExtents(vertices)
+            planes = PanelLogic.yPlanes(vertices, triangles)
+            body_thickness = PanelLogic.meshThickness(planes, (min_point, max_point))
+        else:
+            # Without NumPy fall back to the bounding box of the body.
+            box = body.boundingBox
+            min_point = [box.minPoint.x, box.minPoint.y, box.minPoint.z]
+            max_point = [box.maxPoint.x, box.maxPoint.y, box.maxPoint.z]
+            if rotation:
+                min_point, max_point = PanelLogic.transformExtents(min_point, max_point, rotation)
+            body_thickness = None
+
+        snapshot.append({
+            "name": body.name,
+            "min": min_point,
+            "max": max_point,
+            "thickness": body_thickness,
+            "volume": body.volume
+        })
+    return snapshot
+
+def planPanel():            # This function plans the whole run without changing the design.
+    try:
+        rotation = frontRotation()
+        if rotation is False:
+            return
 
-        # Define target normal (global negative Y)
-        target_normal = adsk.core.Vector3D.create(0, -1, 0)
-
-        # Compute rotation axis (perpendicular to both)
-        rotation_axis = current_normal.crossProduct(target_normal)
+        # Read all the geometry on the main thread, the Fusion API can only be used from there.
+        start = time.perf_counter()
+        snapshot = snapshotBodies(rotation)
 
-        # Check for edge cases: already aligned or exactly opposite
-        if rotation_axis.length < 1e-6:
-            dot = current_normal.dotProduct(target_normal)
-            if dot > 0:
-                ui.messageBox("Face is already aligned with target. No rotation needed.")
+        # Stop before anything is changed if the Revit export is not what the script expects.
+        checks = PanelLogic.preflight(snapshot)
+        if checks["errors"]:
+            ui.messageBox("\n".join(f"\u2022 {problem}" for problem in checks["errors"] + checks["warnings"]) + "\n\nScript stopped.",
+                          "Pre-Flight Check")
+            return
+        if checks["warnings"]:
+            question_text = "\n".join(f"\u2022 {problem}" for problem in checks["warnings"]) + "\n\nContinue with this panel?"
+            button_type = adsk.core.MessageBoxButtonTypes.YesNoButtonType
+            warning_icon = adsk.core.MessageBoxIconTypes.WarningIconType
+            if ui.messageBox(question_text, "Pre-Flight Check", button_type, warning_icon) != adsk.core.DialogResults.DialogYes:
                 return
-            else:
-                # Opposite direction: rotate 180 degrees around global Z
-                rotation_axis = adsk.core.Vector3D.create(0, 0, 1)
-                angle = math.pi
+
+        # Plan on a worker thread while the main thread resolves the machine and template libraries.
+        analysis = analysisPool().submit(PanelLogic.buildPlan, snapshot, app.activeDocument.name, rotation)
+        resolveLibraries()
+        new_plan = analysis.result()
+
+        # The listings are kept for the session, list them again if a template is missing in case it was added since.
+        # A template that is still missing is reported when the templates are loaded.
+        new_plan["bodyNames"] = [body["name"] for body in snapshot]
+        if PanelLogic.checkTemplates(new_plan, [item.name for item in libraries["templates"]]):
+            resolveLibraries(refresh=True)
+        new_plan["analysisTime"] = round((time.perf_counter() - start) * 1000, 3)
+
+        if not new_plan["valid"]:
+            ui.messageBox("\n".join(new_plan["warnings"]) + "\nScript stopped.")
+            return
+        ctx.plan = new_plan
+    except:
+        ui.messageBox(f"planPanel(): failed:\n{traceback.format_exc()}")
+
+def planPath():             # This function returns the file the plan of the active document is saved to.
+    panel_number = PanelLogic.panelNumber(app.activeDocument.name)
+    return os.path.join(plan_folder, f"{panel_number} plan.json")
+
+def savePlan():             # This function saves the plan as JSON and shows what the script would do.
+    try:
+        os.makedirs(plan_folder, exist_ok=True)
+        with open(planPath(), "w") as plan_file:
+            json.dump(ctx.plan, plan_file, indent=4)
+
+        lines = [f"Plan saved to {planPath()} ({ctx.plan['analysisTime']:.0f} ms)."]
+        lines.extend(f"{r['from']} \u2192 {r['to']}" for r in ctx.plan["renames"])
+        for setup_plan in ctx.plan["setups"]:
+            lines.append(f"{setup_plan['name']} ({setup_plan['programName']}): {', '.join(setup_plan['templates'])}")
+        lines.extend(ctx.plan["messages"] + ctx.plan["warnings"])
+        ui.messageBox("\n".join(lines), "Panel Plan")
+    except:
+        ui.messageBox(f"savePlan(): failed:\n{traceback.format_exc()}")
+
+def loadPlan():             # This function loads the saved plan of the active document and checks it still matches the design.
+    try:
+        if not os.path.exists(planPath()):
+            ui.messageBox(f"No saved plan could be found at {planPath()}. Script stopped.")
+            return
+
+        with open(planPath(), "r") as plan_file:
+            saved_plan = json.load(plan_file)
+
+        body_names = [body.name for body in ctx.rootComp.bRepBodies]
+        if body_names != saved_plan["bodyNames"]:
+            ui.messageBox("The bodies in the design do not match the saved plan. Script stopped.")
+            return
+        ctx.plan = saved_plan
+    except:
+        ui.messageBox(f"loadPlan(): failed:\n{traceback.format_exc()}")
+
+def startPrep():            # This function notes where the geometry prep starts and turns off history in direct mode.
+    try:
+        ctx.prep_start = time.perf_counter()
+        if prep_mode == "direct":
+            ctx.design.designType = adsk.fusion.DesignTypes.DirectDesignType
+        elif ctx.design.designType == adsk.fusion.DesignTypes.ParametricDesignType:
+            ctx.timeline_start = ctx.design.timeline.count
+    except:
+        ui.messageBox(f"startPrep(): failed:\n{traceback.format_exc()}")
+
+def finishPrep():           # This function collapses the geometry prep features into one timeline group or turns history back on.
+    try:
+        if prep_mode == "direct":
+            # The prepared bodies and WCS points become the start of the new timeline the setups reference.
+            ctx.design.designType = adsk.fusion.DesignTypes.ParametricDesignType
+        elif prep_mode == "group" and ctx.design.designType == adsk.fusion.DesignTypes.ParametricDesignType:
+            timeline = ctx.design.timeline
+            if timeline.count - ctx.timeline_start > 1:
+                group = timeline.timelineGroups.add(ctx.timeline_start, timeline.count - 1)
+                group.name = "Panel Prep"
+                group.isCollapsed = True
+    except:
+        ui.messageBox(f"finishPrep(): failed:\n{traceback.format_exc()}")
+
+def prepTime():             # This function adds the time from the start of the geometry prep to the setups to the summary.
+    if ctx.prep_start is not None:
+        ctx.details.append(f"Geometry prep to setups: {time.perf_counter() - ctx.prep_start:.1f} s ({prep_mode}).")
+
+def loadSisterIndex():      # This function loads the sister panel index, empty if there is none yet.
+    if not os.path.exists(sister_index):
+        return {}
+    with open(sister_index, "r") as index_file:
+        return json.load(index_file)
+
+def recordSister():         # This function records the processed panel in the sister panel index.
+    try:
+        document = app.activeDocument
+        data_file = document.dataFile
+        if not data_file:
+            addMessage("The panel has not been saved: It was not added to the sister panel index.")
+            return
+        # A sister is opened at the latest version of its file, so the setups and toolpaths are saved before it is recorded.
+        if document.isModified and not document.save("Setups and toolpaths from the panel script"):
+            addMessage("The panel could not be saved: It was not added to the sister panel index.")
+            return
+        index = loadSisterIndex()
+        index[ctx.plan["sisterKey"]] = {
+            "document": document.name,
+            "panel": ctx.plan["panel"],
+            "dataFileId": data_file.id,
+            "processed": time.strftime("%Y-%m-%d %H:%M")
+        }
+        os.makedirs(os.path.dirname(sister_index), exist_ok=True)
+        with open(sister_index, "w") as index_file:
+            json.dump(index, index_file, indent=4)
+    except:
+        ui.messageBox(f"recordSister(): failed:\n{traceback.format_exc()}")
+
+def sisterProblems(document, plan):  # This function lists what keeps the setups of an opened sister panel from being posted as they are.
+    cam = adsk.cam.CAM.cast(document.products.itemByProductType('CAMProductType'))
+    if not cam:
+        return ["It has no setups."]
+    problems = []
+    for setup_plan in plan["setups"]:
+        setup = cam.setups.itemByName(setup_plan["name"])
+        if not setup:
+            problems.append(f"{setup_plan['name']} setup could not be found.")
+            continue
+        invalid = [op.name for op in setup.allOperations if not (op.hasToolpath and op.isToolpathValid)]
+        if not setup.allOperations.count or invalid:
+            problems.append(f"{setup_plan['name']} toolpaths are not valid: {', '.join(invalid) or 'it has no operations'}.")
+    return problems
+
+def cloneSister():          # This function offers to clone a processed panel with the same geometry, True if the script should stop.
+    global ctx
+    try:
+        sister = loadSisterIndex().get(ctx.plan["sisterKey"])
+        if not sister or sister["panel"] == ctx.plan["panel"]:
+            return False
+        source = app.data.findFileById(sister["dataFileId"])
+        if not source:
+            return False
+
+        if app.activeDocument.dataFile:
+            closed_text = f"after renaming its file to {ctx.plan['panel']}{raw_suffix}"
         else:
-            rotation_axis.normalize()
-            # Rotation angle
-            dot = max(-1.0, min(1.0, current_normal.dotProduct(target_normal)))
-            angle = math.acos(dot)
-
-        # Compute rotation origin (center of the root component)
-        bbox = rootComp.boundingBox
-        rotation_origin = adsk.core.Point3D.create(
-            (bbox.minPoint.x + bbox.maxPoint.x) / 2.0,
-            (bbox.minPoint.y + bbox.maxPoint.y) / 2.0,
-            (bbox.minPoint.z + bbox.maxPoint.z) / 2.0
-        )
-
-        # Create transformation matrix
-        transform = adsk.core.Matrix3D.create()
-        transform.setToRotation(angle, rotation_axis, rotation_origin)
-
-        # Collect all bodies to move
-        bodies = adsk.core.ObjectCollection.create()
-        for body in rootComp.bRepBodies:
-            bodies.add(body)
-        if bodies.count == 0:
-            ui.messageBox("No bodies found in root component. Script stopped.")
+            closed_text = "without saving it"
+        question_text = f"""{ctx.plan['panel']} has the same geometry as {sister['document']} (processed {sister['processed']}).\n
+        \u2022 'Yes' will save a copy of {sister['document']} with its setups and toolpaths as {ctx.plan['panel']} and close this document {closed_text}.\n
+        \u2022 'No' will run the script on this panel."""
+        button_type = adsk.core.MessageBoxButtonTypes.YesNoButtonType
+        question_icon = adsk.core.MessageBoxIconTypes.QuestionIconType
+        if ui.messageBox(question_text, "Sister Panel", button_type, question_icon) != adsk.core.DialogResults.DialogYes:
+            return False
+    except:
+        ui.messageBox(f"cloneSister(): failed:\n{traceback.format_exc()}")
+        return False
+
+    # Nothing is renamed or closed until the sister is open and its setups can be posted as they are.
+    raw_document = app.activeDocument
+    data_file = raw_document.dataFile
+    folder = data_file.parentFolder if data_file else source.parentFolder
+    plan = ctx.plan
+    raw_name = data_file.name if data_file else None
+    clone = None
+    saved = False
+    try:
+        clone = app.documents.open(source, True)
+        problems = sisterProblems(clone, plan)
+        if problems:
+            clone.close(False)
+            raw_document.activate()
+            problem_text = "\n".join(f"\u2022 {problem}" for problem in problems)
+            ui.messageBox(f"{sister['document']} could not be cloned, the script will run on this panel:\n{problem_text}")
+            return False
+
+        # The copy replaces this panel: the unprocessed file is renamed, the copy is saved under the panel number next to
+        # it and becomes the active document of the run, and the unprocessed document is closed last.
+        if data_file:
+            data_file.name = plan["panel"] + raw_suffix
+        clone.saveAs(plan["panel"], folder, f"Cloned from {sister['document']}", "")
+        saved = True
+        clone.activate()
+        ctx = PanelRun()
+        ctx.plan = plan
+
+        # Only the program names change, the toolpaths stay valid.
+        camWorkspace()
+        for setup_plan in plan["setups"]:
+            clone_setup = ctx.setups.itemByName(setup_plan["name"])
+            values = {"job_programName": setup_plan["parameters"]["job_programName"]}
+            for failed in PanelLogic.applyParameters(clone_setup.parameters, values, {}):
+                addMessage(f"{setup_plan['name']} setup parameter could not be set: {failed}")
+        raw_document.close(False)
+        addMessage(f"The setups and toolpaths were cloned from {sister['document']} into {folder.name}/{plan['panel']}.")
+        if data_file:
+            addMessage(f"The unprocessed panel was renamed to {plan['panel']}{raw_suffix} and closed.")
+    except:
+        # The copy is closed and the unprocessed file gets its name back, the script stops so nothing runs on the wrong document.
+        failure = traceback.format_exc()
+        try:
+            if clone and clone.isValid:
+                clone.close(False)
+            if data_file and data_file.name != raw_name:
+                data_file.name = raw_name
+            if raw_document.isValid:
+                raw_document.activate()
+            if saved:
+                failure += f"\nThe saved copy {folder.name}/{plan['panel']} was left in place."
+        except:
+            failure += f"\nThe clone could not be undone:\n{traceback.format_exc()}"
+        ui.messageBox(f"cloneSister(): failed, the script has stopped:\n{failure}")
+        return True
+
+    postPrograms()
+    showAllMessages()
+    return True
+
+def moveAllBodies(transform):  # This function moves all bodies in the root component with one move feature.
+    bodies = adsk.core.ObjectCollection.create()
+    for body in ctx.rootComp.bRepBodies:
+        bodies.add(body)
+    move_input = ctx.rootComp.features.moveFeatures.createInput(bodies, transform)
+    ctx.rootComp.features.moveFeatures.add(move_input)
+
+def rotateBodiesToFront():
+    try:
+        if not ctx.plan["rotation"]:
             return
 
         # Apply the move
-        move_input = rootComp.features.moveFeatures.createInput(bodies, transform)
-        rootComp.features.moveFeatures.add(move_input)
+        transform = adsk.core.Matrix3D.create()
+        transform.setWithArray(ctx.plan["rotation"])
+        moveAllBodies(transform)
 
         # Optional: reset the camera to front view
         camera = app.activeViewport.camera
@@ -126,87 +752,57 @@ def rotateBodiesToFront():
 
 def moveBodiesToOrgin():
     try:
-        # Find 'Body1' and rename as "Exterior"
-        body1 = None
-        for body in rootComp.bRepBodies:
-            if body.name == 'Body1':
-                body1 = body
-                break       
-            
-        # Rename the selected body
-        body1.name = "Exterior"
-
-        # Create a vector representing panel coordinate system
-        panelCoord = adsk.core.Vector3D.create(body1.boundingBox.maxPoint.x, body1.boundingBox.maxPoint.y, body1.boundingBox.maxPoint.z)
-
-        # Create a vector representing the translation needed to move to the origin (0,0,0)
-        translationVector = adsk.core.Vector3D.create(-panelCoord.x, -panelCoord.y, -panelCoord.z)
-
-        # Create a transformation matrix from the translation vector
+        # Create a transformation matrix from the planned translation to the origin (0,0,0)
         transformMatrix = adsk.core.Matrix3D.create()
-        transformMatrix.translation = translationVector
-
-        # Get the move features collection
-        moveFeatures = rootComp.features.moveFeatures
-
-        # Create an ObjectCollection to hold ALL bodies to be moved
-        bodiesToMove = adsk.core.ObjectCollection.create()
-        for body in rootComp.bRepBodies:
-            bodiesToMove.add(body)
-
-        # Create a move input with all bodies and the transformation matrix
-        moveInput = moveFeatures.createInput(bodiesToMove, transformMatrix)
-
-        # Add the move feature to the design
-        moveFeatures.add(moveInput)
+        transformMatrix.translation = adsk.core.Vector3D.create(*ctx.plan["translation"])
+        moveAllBodies(transformMatrix)
 
         # Fit the view to the new position of the assembly
         app.activeViewport.fit()
     except:
         ui.messageBox(f"moveBodiesToOrgin(): failed:\n{traceback.format_exc()}")
 
-def stockBody():
-    try: 
-        # Find Exterior Body 
-        target_body_name = "Exterior"
-        body_to_copy = None
-        for body in rootComp.bRepBodies:
-            if body.name == target_body_name:
-                body_to_copy = body
-                break
-
-        # Copy the body
-        copy_paste_features = rootComp.features.copyPasteBodies
-        bodies_to_copy_collection = adsk.core.ObjectCollection.create()
-        bodies_to_copy_collection.add(body_to_copy)
-        new_bodies_collection = copy_paste_features.add(bodies_to_copy_collection).bodies # Get the 'bodies' collection directly
-
-        new_body = new_bodies_collection.item(0) # Get the first (and likely only) copied body
+def stockBody():            # This function builds the Stock body in memory and adds it to the design as one base feature.
+    try:
+        stock_plan = ctx.plan["stock"]
+        temp_brep = adsk.fusion.TemporaryBRepManager.get()
 
-        # Move the new copy -.4 in the Y-axis (will be machine +Z axis)
+        # Copy the Exterior body and move the copy by the stock offset of the machine (-.4 in the Y-axis, will be machine +Z axis)
+        stock = temp_brep.copy(ctx.rootComp.bRepBodies.item(stock_plan["source"]))
         transform = adsk.core.Matrix3D.create()
-        transform.translation = adsk.core.Vector3D.create(0, -0.4, 0)
-
-        move_features = rootComp.features.moveFeatures
-        bodies_to_move = adsk.core.ObjectCollection.create()
-        bodies_to_move.add(new_body)
-
-        move_feature_input = move_features.createInput(bodies_to_move, transform)
-        move_features.add(move_feature_input)
-
-        # Rename the new copy to "Stock"
+        transform.translation = adsk.core.Vector3D.create(*stock_plan["offset"])
+        temp_brep.transform(stock, transform)
+
+        # Remove the bump clearance boxes so the facinghead does not cut the bump.
+        for cut in stock_plan["cuts"]:
+            box_min, box_max = PanelLogic.clearanceBox(cut)
+            center = adsk.core.Point3D.create(*[(low + high) / 2 for low, high in zip(box_min, box_max)])
+            box = temp_brep.createBox(adsk.core.OrientedBoundingBox3D.create(
+                center, adsk.core.Vector3D.create(1, 0, 0), adsk.core.Vector3D.create(0, 1, 0),
+                box_max[0] - box_min[0], box_max[1] - box_min[1], box_max[2] - box_min[2]))
+            temp_brep.booleanOperation(stock, box, adsk.fusion.BooleanTypes.DifferenceBooleanType)
+
+        # Base features only exist in the timeline, without history the body is added directly.
+        if ctx.design.designType == adsk.fusion.DesignTypes.DirectDesignType:
+            new_body = ctx.rootComp.bRepBodies.add(stock)
+        else:
+            base_feature = ctx.rootComp.features.baseFeatures.add()
+            base_feature.startEdit()
+            ctx.rootComp.bRepBodies.add(stock, base_feature)
+            base_feature.finishEdit()
+            base_feature.name = "Stock"
+            new_body = base_feature.bodies.item(0)
+
+        # Rename the new body to "Stock" and hide it
         new_body.name = "Stock"
-        #new_body.appearance = design.appearances.itemByName('Paint - Enamel Glossy (Green)')
-
-        # Hide the stock body
-        adsk.fusion.Design.cast(app.activeProduct).rootComponent.bRepBodies.itemByName('Stock').isVisible = False
+        new_body.isVisible = False
     except:
         ui.messageBox(f"stockBody(): failed:\n{traceback.format_exc()}")
 
 def changeUnits():
     try:
         # Get the UnitManager from the active design
-        unitMgr = design.unitsManager
+        unitMgr = ctx.design.unitsManager
 
         # Get the current default length units as a string
         current_units_str = unitMgr.defaultLengthUnits.lower()
@@ -222,87 +818,111 @@ def changeUnits():
     except:
         ui.messageBox(f"changeUnits(): failed:\n{traceback.format_exc()}")
 
-def identifyFoam():
+def identifyBodies():
     try:
-        foam_dim = in_cm(3.0) 
-        tolerance = in_cm(.001)    
-        foam_bodies = []
-
-        # Look for body that is 3" thick 
-        global foamresult
-        foamresult = False
-        
-        # Iterate through all bodies in the root component.
-        for body in rootComp.bRepBodies:
-            boundingBox = body.boundingBox
-            width = boundingBox.maxPoint.y - boundingBox.minPoint.y
-            
-            if (abs(width - foam_dim) < tolerance):
-                # Add the body to the list and rename it
-                foam_bodies.append(body)
-                body.name = "Foam"
-
-        # Checks for body named "Foam"        
-        if any("Foam" in body.name for body in rootComp.bRepBodies):
-            foamresult = True
+        # Rename the bodies identified by thickness in the plan.
+        for rename in ctx.plan["renames"]:
+            ctx.rootComp.bRepBodies.item(rename["index"]).name = rename["to"]
     except:
-        ui.messageBox(f"identifyFoam(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"identifyBodies(): failed:\n{traceback.format_exc()}")
+
+def cutBody(cut):           # This function cuts the bodies named in the cut with a rectangle drawn on the XZ plane.
+    # Only the bodies being cut are visible while the cut is made.
+    cut_bodies = []
+    for body in ctx.rootComp.bRepBodies:
+        body.isVisible = body.name == cut["body"]
+        if body.isVisible:
+            cut_bodies.append(body)
+
+    # Sketch on XZ plane (front view)
+    sketch = ctx.rootComp.sketches.add(ctx.rootComp.xZConstructionPlane)
+
+    # Draw rectangle in sketch plane coordinates (X = horizontal, Y = vertical)
+    lines = sketch.sketchCurves.sketchLines
+    lines.addTwoPointRectangle(adsk.core.Point3D.create(cut["x1"], 0, 0),
+                               adsk.core.Point3D.create(cut["x2"], 550, 0))
+
+    extrudes = ctx.rootComp.features.extrudeFeatures
+    extrudeInput = extrudes.createInput(sketch.profiles[0], adsk.fusion.FeatureOperations.CutFeatureOperation)
+    extrudeInput.setDistanceExtent(False, adsk.core.ValueInput.createByReal(cut["depth"]))
+    extrudes.add(extrudeInput)
 
-def identifyBump():
+    for body in cut_bodies:
+        body.isVisible = False
+
+def bumpCuts():             # This function cuts the "Foam" body to prevent the facinghead from cutting the bump, the Stock body is built cut.
     try:
-        global eastBump, westBump
-        eastBump = False
-        westBump = False  
-
-        bump_track_dim = in_cm(6.086)
-        tolerance = in_cm(.001)  
-        bump_track_bodies = [] 
-        
-        # Iterate through all bodies in the root component.
-        for body in rootComp.bRepBodies:
-            boundingBox = body.boundingBox
-
-            length = boundingBox.maxPoint.x - boundingBox.minPoint.x
-            width = boundingBox.maxPoint.y - boundingBox.minPoint.y
-            height = boundingBox.maxPoint.z - boundingBox.minPoint.z
-            
-            if (abs(length - bump_track_dim) < tolerance) :
-                # Add the body to the list and rename it
-                bump_track_bodies.append(body)
-                body.name = "Bump"
-
-        # Bump stud 6" X 2.5"
-        bump_stud_w_dim = in_cm(6.0)
-        bump_stud_h_dim = in_cm(2.5)
-
-        bump_stud_bodies = [] 
-
-        for body in rootComp.bRepBodies:
-            boundingBox = body.boundingBox
-
-            length = boundingBox.maxPoint.x - boundingBox.minPoint.x
-            width = boundingBox.maxPoint.y - boundingBox.minPoint.y
-            
-            if (abs(length - bump_stud_w_dim) < tolerance and
-                abs(width - bump_stud_h_dim) < tolerance):
-                # Add the body to the list and rename it
-                bump_stud_bodies.append(body)
-                body.name = "Bump"
-
-        # Measure distance from origin to the Bump body
-        bump = next((b for b in rootComp.bRepBodies if b.name == "Bump"), None)
-        if bump:
-            bbox = bump.boundingBox
-            # Measure from the origin (Y=0) to the closest Y point on the body
-            if abs(bbox.minPoint.x) < in_cm(20):
-                eastBump = True
-                bumpEast()
+        for cut in ctx.plan["cuts"]:
+            cutBody(cut)
+    except:
+        ui.messageBox(f"bumpCuts(): failed:\n{traceback.format_exc()}")
+
+def isReturn():
+    try:
+        if not ctx.plan["return"]["ask"]:
+            return
+
+        # Ask User if the panel has a return, only for the sides the return detector is unsure about
+        for side in ctx.plan["return"].get("unsure", ["east"]):
+            hand = "right" if side == "east" else "left"
+            width = ctx.plan["return"][side + "Width"]
+            if width is None:
+                found_text = "Frame bodies could not be found."
+                return_width = 4.6875
             else:
-                westBump = True
-                bumpWest()
-            addMessage("A bump has been detected. Adjust toolpaths accordingly.")
+                found_text = f"The frame ends {width / 2.54:.3f}\" from the {hand} hand side of the Exterior body."
+                return_width = width / 2.54
+            if side == "east":
+                answers = f"""\u2022 'No' will place the coordinate system at 0.0625\" from the Exterior body.\n
+        \u2022 'Yes' will place the coordinate system at {return_width:.4f}\" from the Exterior body."""
+            else:
+                answers = """\u2022 'No' will only add the return operations to the Charles setup for a right hand side return.\n
+        \u2022 'Yes' will add the return operations to the Charles setup."""
+            question_text = f"""{found_text} Check the drawing for a return on the {hand} hand side of the panel.\n 
+        {answers}"""
+            button_type = adsk.core.MessageBoxButtonTypes.YesNoButtonType
+            warning_icon = adsk.core.MessageBoxIconTypes.WarningIconType
+            is_return_result = ui.messageBox(question_text, "Warning", button_type, warning_icon)
+            PanelLogic.setReturn(ctx.plan, side, is_return_result == adsk.core.DialogResults.DialogYes)
+    except:
+        ui.messageBox(f"isReturn(): failed:\n{traceback.format_exc()}")
+
+def wcsOrigins():
+    try:
+        for point_name, point in ctx.plan["wcs"].items():
+            # Create a sketch and add a sketch point
+            sketch = ctx.rootComp.sketches.add(ctx.rootComp.xYConstructionPlane)
+            sketchPoint = sketch.sketchPoints.add(adsk.core.Point3D.create(*point))
+            constructionPoints = ctx.rootComp.constructionPoints
+            point_input = constructionPoints.createInput()
+            point_input.setByPoint(sketchPoint)
+            new_point = constructionPoints.add(point_input)
+            new_point.name = point_name
+        app.activeViewport.fit()
+    except:
+        ui.messageBox(f"wcsOrigins(): failed:\n{traceback.format_exc()}")
+
+def mergeSheathin():
+    try:
+        if not ctx.plan["merge"]:
+            return
+
+        # Collect the bodies before merging as the body indexes change with each merge.
+        bodies_to_merge = [ctx.rootComp.bRepBodies.item(index) for index in ctx.plan["merge"]]
+
+        combineFeatures = ctx.rootComp.features.combineFeatures
+        targetBody = bodies_to_merge[0]
+        for toolBody in bodies_to_merge[1:]:
+            toolBodies = adsk.core.ObjectCollection.create()
+            toolBodies.add(toolBody)
+            combineInput = combineFeatures.createInput(targetBody, toolBodies)
+            combineInput.operation = adsk.fusion.FeatureOperations.JoinFeatureOperation
+            combineFeature = combineFeatures.add(combineInput)
+            targetBody = combineFeature.bodies.item(0)
+        targetBody.name = "Sheathing"
+
     except:
-        ui.messageBox(f"identifyBump(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"mergeSheathin(): failed:\n{traceback.format_exc()}")
 
 def identifyWindows():      # This function tries to detect if the panel has windows. Goal is to determine to add the window bevel toolpath or not.
     
@@ -312,14 +932,21 @@ def identifyWindows():      # This function tries to detect if the panel has win
         target_y = -6.625     # inches
         tolerance = 0.01      # inches tolerance
 
-        unitsMgr = design.unitsManager
+        unitsMgr = ctx.design.unitsManager
         target_y_cm = unitsMgr.evaluateExpression(f"{target_y} in", "cm")
         tol_cm = unitsMgr.evaluateExpression(f"{tolerance} in", "cm")
 
-        for body in rootComp.bRepBodies:
+        for body in ctx.rootComp.bRepBodies:
             if body.name != "Sheathing":
                 continue  # only check the sheathing body
 
+            # Skip the faces when the mesh shows there is no plane near Y = -6.625 in
+            if PanelLogic.np is not None:
+                vertices, triangles = bodyMesh(body)
+                plane, distance = PanelLogic.nearestPlane(PanelLogic.yPlanes(vertices, triangles), target_y_cm)
+                if distance > tol_cm:
+                    continue
+
             #ui.messageBox(f'Checking body: {body.name}')
 
             for face in body.faces:
@@ -361,812 +988,500 @@ def identifyWindows():      # This function tries to detect if the panel has win
     except:
         ui.messageBox('identifyWindows() Failed:\n{}'.format(traceback.format_exc()))
 
-def bumpEast():             # This function cuts the "Stock" and "Foam" bodies to prevent the facinghead from cutting the bump.
+def prefetchBIM():          # This function starts filling the BIM cache in the background for the panels that are open.
     try:
-        # Hide all bodies in the root component
-        for body in rootComp.bRepBodies:
-            body.isVisible = False
-
-        # Show Stock body
-        for body in rootComp.bRepBodies:
-            if body.name == "Stock":
-                body.isVisible = True
-                stock_body = body
-
-        # Sketch on XZ plane (front view)
-        sketches = rootComp.sketches
-        xzPlane = rootComp.xZConstructionPlane
-        sketch = sketches.add(xzPlane)
-
-        # Offset from bump
-        x_offset = 32 #inches
-        x_offset = (x_offset * 2.54 * -1) # convert to CM and change to be negative
-
-        # Draw rectangle in sketch plane coordinates (X = horizontal, Y = vertical)
-        lines = sketch.sketchCurves.sketchLines
-        lines.addTwoPointRectangle(adsk.core.Point3D.create(x_offset, 0, 0),
-                                   adsk.core.Point3D.create(0, 550, 0))
-
-        extrudes = rootComp.features.extrudeFeatures
-        extrudeInput = extrudes.createInput(sketch.profiles[0], adsk.fusion.FeatureOperations.CutFeatureOperation)
-        distance = adsk.core.ValueInput.createByReal(-15 * 2.54)
-        extrudeInput.setDistanceExtent(False, distance)
-        extrudes.add(extrudeInput)
-
-        # Hide Stock body
-        stock_body.isVisible = False
-
-
-        # Cut foam body
-        if foamresult == True:
-            # Show Stock body
-            for body in rootComp.bRepBodies:
-                if body.name == "Foam":
-                    body.isVisible = True
-                    foam_body = body
-
-            # Sketch on XZ plane (front view)
-            sketches = rootComp.sketches
-            xzPlane = rootComp.xZConstructionPlane
-            sketch = sketches.add(xzPlane)
-
-            # Offset from bump
-            x_offset = 8 #inches
-            x_offset = (x_offset * 2.54 * -1) # convert to CM and change to be negative
-
-            # Draw rectangle in sketch plane coordinates (X = horizontal, Y = vertical)
-            lines = sketch.sketchCurves.sketchLines
-            lines.addTwoPointRectangle(adsk.core.Point3D.create(x_offset, 0, 0),
-                                    adsk.core.Point3D.create(0, 550, 0))
-
-            extrudes = rootComp.features.extrudeFeatures
-            extrudeInput = extrudes.createInput(sketch.profiles[0], adsk.fusion.FeatureOperations.CutFeatureOperation)
-            distance = adsk.core.ValueInput.createByReal(-15 * 2.54)
-            extrudeInput.setDistanceExtent(False, distance)
-            extrudes.add(extrudeInput)
-
-            # Hide Foam body
-            foam_body.isVisible = False
-        
-    except:
-        ui.messageBox(f"bumpEast(): failed:\n{traceback.format_exc()}")
-
-def bumpWest():             # This function cuts the "Stock" and "Foam" bodies to prevent the facinghead from cutting the bump.
-    try:
-        # Hide all bodies in the root component
-        for body in rootComp.bRepBodies:
-            body.isVisible = False
-
-        # Hide all bodies in the root component
-        for body in rootComp.bRepBodies:
-            if body.name == "Stock":
-                body.isVisible = True
-                stock_body = body
-
-        # Sketch on XZ plane (front view)
-        sketches = rootComp.sketches
-        xzPlane = rootComp.xZConstructionPlane
-        sketch = sketches.add(xzPlane)
-    
-        # Bounding box of the Stock body
-        bb = stock_body.boundingBox
-        min_x = bb.minPoint.x
-
-        # Offset from bump
-        x_offset = 32 #inches
-        x_offset = (x_offset * 2.54 * -1) # convert to CM and change to be negative
-
-        # Draw rectangle in sketch plane coordinates (X = horizontal, Y = vertical)
-        lines = sketch.sketchCurves.sketchLines
-        lines.addTwoPointRectangle(adsk.core.Point3D.create(min_x, 0, 0),
-                                   adsk.core.Point3D.create((min_x - x_offset), 550, 0))
-
-        extrudes = rootComp.features.extrudeFeatures
-        extrudeInput = extrudes.createInput(sketch.profiles[0], adsk.fusion.FeatureOperations.CutFeatureOperation)
-        distance = adsk.core.ValueInput.createByReal(-15 * 2.54)
-        extrudeInput.setDistanceExtent(False, distance)
-        extrudes.add(extrudeInput)
-
-        stock_body.isVisible = False
-
-        # Cut foam body
-        if foamresult == True:
-            # Show Stock body
-            for body in rootComp.bRepBodies:
-                if body.name == "Foam":
-                    body.isVisible = True
-                    foam_body = body
-
-            # Sketch on XZ plane (front view)
-            sketches = rootComp.sketches
-            xzPlane = rootComp.xZConstructionPlane
-            sketch = sketches.add(xzPlane)
-
-            # Offset from bump
-            x_offset = 8 #inches
-            x_offset = (x_offset * 2.54 * -1) # convert to CM and change to be negative
-
-            # Draw rectangle in sketch plane coordinates (X = horizontal, Y = vertical)
-            lines = sketch.sketchCurves.sketchLines
-            lines.addTwoPointRectangle(adsk.core.Point3D.create(min_x, 0, 0),
-                                   adsk.core.Point3D.create((min_x - x_offset), 550, 0))
-
-            extrudes = rootComp.features.extrudeFeatures
-            extrudeInput = extrudes.createInput(sketch.profiles[0], adsk.fusion.FeatureOperations.CutFeatureOperation)
-            distance = adsk.core.ValueInput.createByReal(-15 * 2.54)
-            extrudeInput.setDistanceExtent(False, distance)
-            extrudes.add(extrudeInput)
-
-            # Hide Foam body
-            foam_body.isVisible = False
-    
+        global bim_prefetch
+        if bim_prefetch and bim_prefetch.is_alive():
+            return
+        panels = [PanelLogic.panelNumber(document.name) for document in app.documents]
+        bim_prefetch = threading.Thread(target=BIMCache.prefetch, args=(bim_cache, panels, bim_export_file, bim_service_url),
+                                        daemon=True)
+        bim_prefetch.start()
     except:
-        ui.messageBox(f"bumpWest(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"prefetchBIM(): failed:\n{traceback.format_exc()}")
 
-def identifyStuds():
-    try:
-        stud_dim = in_cm(6.0)
-        tolerance = in_cm(.001)
-        stud_bodies = [] 
-        
-        # Iterate through all bodies in the root component.
-        for body in rootComp.bRepBodies:
-            boundingBox = body.boundingBox
-            width = boundingBox.maxPoint.y - boundingBox.minPoint.y
-            
-            if (abs(width - stud_dim) < tolerance):
-                # Add the body to the list and rename it
-                stud_bodies.append(body)
-                body.name = "Stud"
-    except:
-        ui.messageBox(f"identifyStuds(): failed:\n{traceback.format_exc()}")
-            
-def identifyTrack():
+def openBIM():
     try:
-        track_dim = in_cm(6.143)
-        tolerance = in_cm(.001)
-        track_bodies = [] 
-        
-        # Iterate through all bodies in the root component.
-        for body in rootComp.bRepBodies:
-            boundingBox = body.boundingBox
-            width = boundingBox.maxPoint.y - boundingBox.minPoint.y
-            
-            if (abs(width - track_dim) < tolerance) :
-                # Add the body to the list and rename it
-                track_bodies.append(body)
-                body.name = "Track"
-    except:
-        ui.messageBox(f"identifyTrack(): failed:\n{traceback.format_exc()}")
+        global bim_process, bim_panel
+        panel_number = PanelLogic.panelNumber(app.activeDocument.name)
+        ctx.bim = BIMCache.lookup(bim_cache, panel_number)
 
-def openBIM():
-    try:    
         script_path = r"C:\Users\ahughes\Documents\Python BIM\pyBIM.pyw"
         if os.path.exists(script_path):
-            current_doc_name = app.activeDocument.name
-            panel_number = re.sub(r'\s*[vV]\d+', '', current_doc_name) 
+
+            # pyBIM takes the panel on the command line, keep it open while it still shows this panel.
+            if bim_process and bim_process.poll() is None and bim_panel == panel_number:
+                return
             system_python = r"C:/Users/ahughes/AppData/Local/Programs/Python/Python313/pythonw.exe"
-            subprocess.Popen([system_python, os.path.realpath(script_path), panel_number])
+            bim_process = subprocess.Popen([system_python, os.path.realpath(script_path), panel_number])
+            bim_panel = panel_number
             time.sleep(1)
-        else:
+        elif ctx.bim is None:
+            # Only open the web page when the BIM fields of the panel are not cached.
             webbrowser.open_new_tab("https://bim360field.autodesk.com/equipment") 
     except:
         ui.messageBox(f"openBIM(): failed:\n{traceback.format_exc()}")
 
-def isReturn():
-    global is_return_result, west_return 
-    is_return_result = adsk.core.DialogResults.DialogNo
-    west_return = False
-
+def camWorkspace():
     try:
-        studs = [body for body in rootComp.bRepBodies if body.name.startswith("Stud")]
-        if not studs:
-            # Ask User if the panel has a return
-            question_text = """Frame bodies could not be found. Check the drawing for a return on the right hand side of the panel.\n 
-        \u2022 'No' will place the coordinate system at 0.0625\" from the Exterior body.\n
-        \u2022 'Yes' will place the coordinate system at 4.6875\" from the Exterior body.""" 
-            button_type = adsk.core.MessageBoxButtonTypes.YesNoButtonType
-            warning_icon = adsk.core.MessageBoxIconTypes.WarningIconType
-            is_return_result = ui.messageBox(question_text, "Warning", button_type, warning_icon)
-            addMessage("Frame bodies could not be found.")
-            return None, None
+        # Switch to Manufacture Workspace
+        ui.workspaces.itemById('CAMEnvironment').activate()
 
-        # The code below tried to identify if there is a return on either side of the Panel.
-        # Initialize min and max values
-        min_x, min_y, min_z = float('inf'), float('inf'), float('inf')
-        max_x, max_y, max_z = float('-inf'), float('-inf'), float('-inf')
+        # Get the CAM product from the document's products collection and its Setups collection.
+        cam_product = app.activeDocument.products.itemByProductType('CAMProductType')
+        ctx.cam = adsk.cam.CAM.cast(cam_product)
+        ctx.setups = ctx.cam.setups
 
-        # Loop through all "Stud" bodies and expand bounds
-        for body in studs:
-            box = body.boundingBox
-            min_x = min(min_x, box.minPoint.x)
-            min_y = min(min_y, box.minPoint.y)
-            min_z = min(min_z, box.minPoint.z)
-            max_x = max(max_x, box.maxPoint.x)
-            max_y = max(max_y, box.maxPoint.y)
-            max_z = max(max_z, box.maxPoint.z)
-
-        # Create Point3D objects for easy use later
-        global stud_max_point
-        stud_min_point = adsk.core.Point3D.create(min_x, min_y, min_z)
-        stud_max_point = adsk.core.Point3D.create(max_x, max_y, max_z)
-            
-        if abs(stud_max_point.x / 2.54) > 4:
-            is_return_result = adsk.core.DialogResults.DialogYes
-        
-        min_x, min_y, min_z = float('inf'), float('inf'), float('inf')
-
-        for body in rootComp.bRepBodies:
-            if body.name == "Exterior":  
-                box = body.boundingBox
-                min_x = min(min_x, box.minPoint.x)
-                min_y = min(min_y, box.minPoint.y)
-                min_z = min(min_z, box.minPoint.z)
-        
-        exterior_min_point = adsk.core.Point3D.create(min_x, min_y, min_z)
-
-        
-        if (abs(exterior_min_point.x / 2.54) - abs(stud_min_point.x / 2.54)) > 4:
-            west_return = True
-    
+        # The first body in the model is the model geometry of the setups.
+        ctx.camOcc = ctx.cam.designRootOccurrence
     except:
-        ui.messageBox(f"isReturn(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"camWorkspace(): failed:\n{traceback.format_exc()}")
 
-def melvinOrgin():
+def resolveLibraries(refresh=False):  # This function lists the local and cloud machines and the cloud templates once per session.
+    global libraries
+    if libraries and not refresh:
+        return libraries
+
+    libraryManager = adsk.cam.CAMManager.get().libraryManager
+    library_locations = {
+        "local": adsk.cam.LibraryLocations.LocalLibraryLocation,
+        "cloud": adsk.cam.LibraryLocations.CloudLibraryLocation
+    }
+    machineLibrary = libraryManager.machineLibrary
+    machines = {library: list(machineLibrary.childMachines(machineLibrary.urlByLocation(location)))
+                for library, location in library_locations.items()}
+
+    # Load templates from cloud
+    templateLibrary = libraryManager.templateLibrary
+    cloud_template_url = templateLibrary.urlByLocation(adsk.cam.LibraryLocations.CloudLibraryLocation)
+    libraries = {"machines": machines, "templates": list(templateLibrary.childTemplates(cloud_template_url))}
+    machine_items.clear()
+    return libraries
+
+def findMachine(model, library):  # This function finds a machine by model name in the local or cloud machine library, once per session.
+    key = (library, model)
+    if key not in machine_items:
+        machine_items[key] = next((machine_item for machine_item in resolveLibraries()["machines"][library]
+                                   if machine_item.model == model), None)
+    return machine_items[key]
+
+def createSetup(setup_plan, cloud_templates):  # This function creates a setup from the plan and loads its templates.
+    # Specify the first body in the model as the model geometry.
+    setupInput = ctx.setups.createInput(adsk.cam.OperationTypes.MillingOperation)
+    setupInput.models = [ctx.camOcc.bRepBodies[0]]
+
+    new_setup = ctx.setups.add(setupInput)
+    new_setup.name = setup_plan["name"]
+    new_setup.machine = findMachine(setup_plan["machine"], setup_plan["machineLibrary"])
+
+    # Program name, stock mode and WCS, with the origin point and the model's Y construction axis as the setup Z axis
+    values = dict(setup_plan["parameters"])
+    values["wcs_origin_point"] = [ctx.rootComp.constructionPoints.itemByName(setup_plan["origin"])]
+    values["wcs_orientation_axisZ"] = [ctx.rootComp.yConstructionAxis]
+    handles = ctx.parameter_handles.setdefault(setup_plan["name"], {})
+    for failed in PanelLogic.applyParameters(new_setup.parameters, values, handles):
+        addMessage(f"{setup_plan['name']} setup parameter could not be set: {failed}")
+
+    # Select the stock body, a box stock was already set by its parameters
+    if setup_plan.get("stockMode", "solid") == "solid":
+        stock_solids_collection = adsk.core.ObjectCollection.create()
+        stock_solids_collection.add(ctx.rootComp.bRepBodies.itemByName(setup_plan["stock"]))
+        new_setup.stockSolids = stock_solids_collection
+
+    # Load the templates in the order with the fewest tool changes. The tool numbers are only known once a template has
+    # been loaded, until then the planned order is kept and the numbers recorded for the next panel.
+    precedence = PanelLogic.template_precedence.get(setup_plan["name"], {})
+    templates = setup_plan["templates"]
+    known = loadTemplateTools()
+    if all(name in known for name in templates):
+        templates = PanelLogic.toolOrder(templates, template_tools, precedence)
+    loaded = loadTemplates(new_setup, templates, cloud_templates)
+
+    planned = [name for name in setup_plan["templates"] if name in loaded]
+    saved = PanelLogic.toolChanges(planned, template_tools) - PanelLogic.toolChanges(loaded, template_tools)
+    if saved > 0:
+        addMessage(f"{setup_plan['name']} operations were reordered to save {saved} tool changes.")
+
+    # Entry points (e.g. the Melvin Perimeter) and the planned changes (bump pass angle, thin foam heights) for each operation
+    op_names = list(setup_plan["entryPoints"]) + [name for name in setup_plan["operations"] if name not in setup_plan["entryPoints"]]
+    for op_name in op_names:
+        op = new_setup.operations.itemByName(op_name)
+        if not op:
+            continue
+        values = dict(setup_plan["operations"].get(op_name, {}))
+        if op_name in setup_plan["entryPoints"]:
+            values["entryPositions"] = [ctx.rootComp.constructionPoints.itemByName(setup_plan["entryPoints"][op_name])]
+
+        handles = ctx.parameter_handles.setdefault(f"{setup_plan['name']} - {op_name}", {})
+        for failed in PanelLogic.applyParameters(op.parameters, values, handles):
+            addMessage(f"{setup_plan['name']} - {op_name} parameter could not be set: {failed}")
+
+    # Every operation is generated so the program can be posted, unless the collision pre-check found a conflict.
+    # Operations that have not changed since their toolpath was generated are skipped when the toolpaths are started.
+    for op in new_setup.allOperations:
+        hits = [c["body"] for c in ctx.plan["collisions"] if c["setup"] == setup_plan["name"] and c["operation"] == op.name]
+        if hits:
+            addMessage(f"{setup_plan['name']} - {op.name} toolpath was not generated: It would hit {', '.join(sorted(set(hits)))}.")
+        else:
+            queueToolpath(op)
+
+def loadTemplates(new_setup, template_names, cloud_templates):  # This function loads the templates into a setup and returns the loaded template names.
+    loaded = []
+    for template_name in template_names:
+        found_template = next((item for item in cloud_templates if item.name == template_name), None)
+        if not found_template:
+            addMessage(f"Template \"{template_name}\" could not be found: It was not loaded into the {new_setup.name} setup.")
+            continue
+        operations = new_setup.createFromCAMTemplate(found_template)
+        tools = [toolNumber(operation) for operation in operations]
+        tools = [tool for tool in tools if tool is not None]
+        if template_tools.get(template_name) != tools:
+            template_tools[template_name] = tools
+            saveTemplateTools()
+        loaded.append(template_name)
+    return loaded
+
+def loadTemplateTools():    # This function reads the recorded tool numbers of the templates once per session.
+    if not template_tools and os.path.exists(template_tools_file):
+        with open(template_tools_file, "r") as json_file:
+            template_tools.update(json.load(json_file))
+    return template_tools
+
+def saveTemplateTools():    # This function records the tool numbers of the templates for the next runs.
     try:
-        body = rootComp.bRepBodies.item(0)
-        
-        # Compute overall bounding box extents
-        min_x, max_x = float('inf'), float('-inf')
-        min_y, max_y = float('inf'), float('-inf')
-        min_z, max_z = float('inf'), float('-inf')
-
-        for face in body.faces:
-            boundingBox = face.boundingBox
-            min_x = min(min_x, boundingBox.minPoint.x)
-            max_x = max(max_x, boundingBox.maxPoint.x)
-            min_y = min(min_y, boundingBox.minPoint.y)
-            max_y = max(max_y, boundingBox.maxPoint.y)
-            min_z = min(min_z, boundingBox.minPoint.z)
-            max_z = max(max_z, boundingBox.maxPoint.z)
-        
-        # Back-top-right corner
-        corner_x, corner_y, corner_z = max_x, max_y, max_z
-
-        # Offsets
-        offset_x = corner_x - in_cm(0.0625)
-        offset_y = corner_y - in_cm(6.0)
-        offset_z = corner_z - in_cm(0.0625)
-
-        # Optional alternate X offset if dialog says “Yes”
-        if is_return_result == adsk.core.DialogResults.DialogYes:
-            if any("Stud" in body.name for body in rootComp.bRepBodies):
-                offset_x = corner_x - (abs(stud_max_point.x))
-            else:
-                offset_x = corner_x - in_cm(4.6875)
-
-        construction_point = adsk.core.Point3D.create(offset_x, offset_y, offset_z)
-
-        # Create the point in the design
-        sketches = rootComp.sketches
-        sketch = sketches.add(rootComp.xYConstructionPlane)
-        sketchPoint = sketch.sketchPoints.add(construction_point)
-        constructionPoints = rootComp.constructionPoints
-        point_input = constructionPoints.createInput()
-        point_input.setByPoint(sketchPoint)
-        new_point = constructionPoints.add(point_input)
-        new_point.name = 'Point1'
-        app.activeViewport.fit()
+        os.makedirs(os.path.dirname(template_tools_file), exist_ok=True)
+        with open(template_tools_file, "w") as json_file:
+            json.dump(template_tools, json_file, indent=4)
     except:
-        ui.messageBox(f"melvinOrgin(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"saveTemplateTools(): failed:\n{traceback.format_exc()}")
 
-def charlesOrgin():
+def toolNumber(operation):  # This function returns the tool number of an operation, None for folders and patterns.
     try:
-        body = rootComp.bRepBodies.item(0)
-        
-        min_x, max_x, min_y, max_y, min_z, max_z = float('inf'), float('-inf'), float('inf'), float('-inf'), float('inf'), float('-inf')
-
-        for face in body.faces:
-            boundingBox = face.boundingBox
-            min_x = min(min_x, boundingBox.minPoint.x); max_x = max(max_x, boundingBox.maxPoint.x)
-            min_y = min(min_y, boundingBox.minPoint.y); max_y = max(max_y, boundingBox.maxPoint.y)
-            min_z = min(min_z, boundingBox.minPoint.z); max_z = max(max_z, boundingBox.maxPoint.z)
-        
-        # Max extents define the "Back Top Right" corner
-        corner_x, corner_y, corner_z = max_x, max_y, max_z
-        
-        # Calculate the offset point (0.0625 inward for X and Z, no offset for Y)
-        offset_x = corner_x - (0.0625 * 2.54) 
-        offset_y = corner_y
-        offset_z = corner_z - (0.0625 * 2.54) 
-
-        if is_return_result == adsk.core.DialogResults.DialogYes:
-            if any("Stud" in body.name for body in rootComp.bRepBodies):
-                offset_x = corner_x - (abs(stud_max_point.x))
-            else:
-                offset_x = corner_x - (4.6875 * 2.54)
-
-        construction_point = adsk.core.Point3D.create(offset_x, offset_y, offset_z)
-
-        # Create a sketch and add a sketch point
-        sketches = rootComp.sketches
-        sketch = sketches.add(rootComp.xYConstructionPlane)  # temporary reference plane
-        sketchPoint = sketch.sketchPoints.add(construction_point)
-        constructionPoints = rootComp.constructionPoints
-        point_input = rootComp.constructionPoints.createInput()
-        point_input.setByPoint(sketchPoint)
-        new_point = constructionPoints.add(point_input)
-        new_point.name = 'Point2'
-        app.activeViewport.fit()
+        return int(operation.tool.parameters.itemByName("tool_number").value.value)
     except:
-        ui.messageBox(f"charlesOrgin(): failed:\n{traceback.format_exc()}")
+        return None
 
-def mergeSheathin():
+def createSetups():
     try:
-        sheathing_thickness = in_cm(0.625)
-        tolerance = in_cm(0.01)
-
-        # Keep merging until only one "Sheathing" body remains
-        for _ in range(2):  # Run up to twice
-            bodies_to_merge = []
-
-            for body in rootComp.bRepBodies:
-                boundingBox = body.boundingBox
-                width = boundingBox.maxPoint.y - boundingBox.minPoint.y
-                if abs(width - sheathing_thickness) < tolerance:
-                    bodies_to_merge.append(body)
-
-            if len(bodies_to_merge) <= 1:
-                break  # Done merging
-
-            combineFeatures = rootComp.features.combineFeatures
-            targetBody = bodies_to_merge[0]
-            for toolBody in bodies_to_merge[1:]:
-                toolBodies = adsk.core.ObjectCollection.create()
-                toolBodies.add(toolBody)
-                combineInput = combineFeatures.createInput(targetBody, toolBodies)
-                combineInput.operation = adsk.fusion.FeatureOperations.JoinFeatureOperation
-                combineFeature = combineFeatures.add(combineInput)
-                targetBody = combineFeature.bodies.item(0)
-                targetBody.name = "Sheathing"
-
+        cloud_templates = resolveLibraries()["templates"]
+        for setup_plan in ctx.plan["setups"]:
+            createSetup(setup_plan, cloud_templates)
+
+        # Show the bump so the modified Facinghead can be checked against it
+        if ctx.plan["bump"]:
+            for body in ctx.rootComp.bRepBodies:
+                if body.name.startswith("Bump"):
+                    body.isVisible = True
     except:
-        ui.messageBox(f"mergeSheathin(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"createSetups(): failed:\n{traceback.format_exc()}")
 
-def camWorkspace():
+def foamErrorDetection():
     try:
-        # Define global variables
-        global cam, setups, doc, cam_product,camOcc, setupInput
-
-        # Switch to Manufacture Workspace
-        ui.workspaces.itemById('CAMEnvironment').activate()
-
-        # Get the active product.
-        cam = adsk.cam.CAM.cast(app.activeProduct)
-
-        # Get the Setups collection.
-        setups = cam.setups
-
-        # Create a SetupsInput object to define a milling setup.
-        setupInput = setups.createInput(adsk.cam.OperationTypes.MillingOperation)
+        # Iterate through all bodies within the current component
+        for body in ctx.rootComp.bRepBodies:
+            # Check if the body's name is "sheathing" (case-sensitive)
+            if body.name == "Sheathing" or body.name.lower() == "foam":
+                body.isVisible = True
 
-        # Get the CAM product from the document's products collection
-        doc = app.activeDocument
-        cam_product = doc.products.itemByProductType('CAMProductType')
-        cam = adsk.cam.CAM.cast(cam_product)
+        # The Foam and Sheathing dimensions were compared when the panel was planned.
+        for warning in ctx.plan["warnings"]:
+            addMessage(warning)
+    except:
+        ui.messageBox(f"foamErrorDection(): failed:\n{traceback.format_exc()}")
 
-        # Specify the first body in the model as the model geometry.
-        camOcc = cam.designRootOccurrence
-        setupInput.models = [camOcc.bRepBodies[0]]
+def queueToolpath(operation):  # This function queues an operation so its toolpath is generated once the setup is final.
+    try:
+        # bumpMod and thinFoam can both modify the Facinghead, only generate it once.
+        if not any(operation == queued for queued in ctx.toolpath_queue):
+            ctx.toolpath_queue.append(operation)
     except:
-        ui.messageBox(f"camWorkspace(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"queueToolpath(): failed:\n{traceback.format_exc()}")
+
+def stockHash(stock_setup):  # This function hashes the geometry of the stock bodies of a setup, or its box stock parameters.
+    if stock_setup.stockSolids.count == 0:
+        parameters = stock_setup.parameters
+        expressions = [parameters.item(i).expression for i in range(parameters.count)
+                       if parameters.item(i).name.startswith("job_stock")]
+        return hashlib.sha1("\n".join(expressions).encode("utf-8")).hexdigest()
+
+    measurements = []
+    for body in stock_setup.stockSolids:
+        box = body.boundingBox
+        measurements.extend([box.minPoint.x, box.minPoint.y, box.minPoint.z,
+                             box.maxPoint.x, box.maxPoint.y, box.maxPoint.z,
+                             body.volume, body.area, body.faces.count, body.edges.count])
+    return PanelLogic.geometryHash(measurements)
+
+def operationFingerprint(operation):  # This function creates the fingerprint used to skip regenerating an unchanged toolpath.
+    expressions = {}
+    handles = ctx.parameter_handles.setdefault(f"{operation.parentSetup.name} - {operation.name}", {})
+    for name in PanelLogic.fingerprint_parameters:
+        parameter = PanelLogic.parameterHandle(operation.parameters, name, handles)
+        if parameter:
+            expressions[name] = parameter.expression
+    return PanelLogic.toolpathFingerprint(expressions, stockHash(operation.parentSetup))
+
+def startToolpaths():       # This function starts generating the queued toolpaths without waiting for them to finish.
+    try:
+        for operation in ctx.toolpath_queue:
+            name = f"{operation.parentSetup.name} - {operation.name}"
+
+            # Skip the operation if nothing changed since its toolpath was generated.
+            fingerprint = operationFingerprint(operation)
+            stored = operation.parentSetup.attributes.itemByName("PanelStartUp", f"fingerprint_{operation.name}")
+            if stored and stored.value == fingerprint and operation.hasToolpath and operation.isToolpathValid:
+                addMessage(f"{name} toolpath is unchanged and was not regenerated.")
+                continue
+
+            future = ctx.cam.generateToolpath(operation)
+            ctx.toolpath_jobs.append({
+                "name": name,
+                "operation": operation,
+                "fingerprint": fingerprint,
+                "future": future,
+                "start": time.time(),
+                "end": None
+            })
+        ctx.toolpath_queue.clear()
+    except:
+        ui.messageBox(f"startToolpaths(): failed:\n{traceback.format_exc()}")
 
-def brickDetail():
-    tolerance_in = 0.5 * 2.54
-    faces_near_min_y = []
-    min_y = float('-inf')
+def waitForToolpaths():     # This function polls the toolpath generation and shows the progress of each operation.
+    try:
+        if not ctx.toolpath_jobs:
+            return
 
-    # Step 1: Find the farthest Y among all bodies
-    for body in rootComp.bRepBodies:
-        bbox = body.boundingBox
-        if bbox.minPoint.y > min_y:
-            min_y = bbox.minPoint.y * 2.54
+        progressDialog = ui.createProgressDialog()
+        progressDialog.isCancelButtonShown = False
+        progressDialog.show("Generating Toolpaths", "Generating toolpaths...", 0, len(ctx.toolpath_jobs), 0)
+
+        # Poll without blocking so Fusion stays responsive while the toolpaths generate.
+        while True:
+            running = []
+            for job in ctx.toolpath_jobs:
+                if job["end"] is None and job["future"].isGenerationCompleted:
+                    job["end"] = time.time()
+                if job["end"] is None:
+                    running.append(job["name"])
+
+            done = len(ctx.toolpath_jobs) - len(running)
+            progressDialog.progressValue = done
+            if not running:
+                break
+            progressDialog.message = f"Generating {running[0]} ({done + 1} of {len(ctx.toolpath_jobs)})..."
+
+            adsk.doEvents()
+            time.sleep(0.1)
+
+        progressDialog.hide()
+
+        # The toolpaths are generated one after the other, so each job is timed from when the job before it finished.
+        previous_end = None
+        for job in sorted(ctx.toolpath_jobs, key=lambda job: job["end"]):
+            job["seconds"] = job["end"] - max(job["start"], previous_end or job["start"])
+            previous_end = job["end"]
+
+        # Add the generation status and time of each operation to the summary.
+        for job in ctx.toolpath_jobs:
+            operation = job["operation"]
+            if operation.hasError:
+                status = "failed"
+            elif operation.hasWarning:
+                status = "generated with warnings"
+            else:
+                status = "generated"
 
-    # Step 2: Check each face to see if its Y is within tolerance
-    for body in rootComp.bRepBodies:
-        for face in body.faces:
-            face_y = face.boundingBox.minPoint.y * 2.54  # or use centroid: face.centroid.y
-            if abs(min_y - face_y) <= tolerance_in:
-                faces_near_min_y.append(face)
-                return True
+            # Store the fingerprint with the setup so the next run can skip this toolpath.
+            if not operation.hasError:
+                operation.parentSetup.attributes.add("PanelStartUp", f"fingerprint_{operation.name}", job["fingerprint"])
+            addMessage(f"{job['name']} toolpath {status} in {job['seconds']:.1f} s.")
+    except:
+        ui.messageBox(f"waitForToolpaths(): failed:\n{traceback.format_exc()}")
 
-    return False
+def operationSignature(operation):  # This function summarizes the parameters and stock of an operation so changes since the last post can be found.
+    parameters = operation.parameters
+    expressions = sorted(f"{parameters.item(i).name}={parameters.item(i).expression}" for i in range(parameters.count))
+    expressions.append(f"stock={stockHash(operation.parentSetup)}")
+    return hashlib.sha1("\n".join(expressions).encode("utf-8")).hexdigest()
 
-def melvinSetup():
+def stockTimes():           # This function records the generation time of each toolpath by stock mode and compares it with the other mode.
     try:
-        if not any("Sheathing" in body.name for body in rootComp.bRepBodies):
-            addMessage("\"Sheathing\" body could not be found: The Melvin setup will not be created.")
-            return
-        else:
-            # Create the setup.
-            setup = setups.add(setupInput)
-
-            # Set the name of the setup to "Melvin"
-            setup.name = "Melvin"
-
-            # Set the program name to file name + "M" for Melvin
-            progNameParam = setup.parameters.itemByName('job_programName')
-            stringVal: adsk.cam.StringParameterValue = progNameParam.value
-            current_doc_name = app.activeDocument.name
-            cleaned_name = re.sub(r'\s*[vV]\d+', '', current_doc_name) 
-            stringVal.value = (cleaned_name + "M")
-            
-            # Find and assign the machine from the Local Library
-            machine_model_to_find = "Melvin"
-            found_machine = None
-
-            # Get the CAMManager and LibraryManager
-            camManager = adsk.cam.CAMManager.get()
-            libraryManager = camManager.libraryManager
-
-            # Get the singular MachineLibrary object
-            machineLibrary = libraryManager.machineLibrary
-
-            # Get the URL for the Local machine library location
-            local_machine_url = machineLibrary.urlByLocation(adsk.cam.LibraryLocations.LocalLibraryLocation)
-            #local_machine_url = machineLibrary.urlByLocation(adsk.cam.LibraryLocations.CloudLibraryLocation)
-
-            # Get the machines from this specific local library URL
-            local_machines = list(machineLibrary.childMachines(local_machine_url))
-
-            # Loop through the found machines to find yours by model name
-            for machine_item in local_machines:
-                if machine_item.model == machine_model_to_find:
-                    found_machine = machine_item
-                    break
-                    
-            setup.machine = found_machine
-
-            # Select Stock for Melvin setup
-            stock_body = rootComp.bRepBodies.itemByName('Sheathing')
-
-            # Change stock mode
-            prmStockMode = setup.parameters.itemByName('job_stockMode')
-            prmStockMode.expression = "'solid'"
-
-            stock_solids_collection = adsk.core.ObjectCollection.create()
-            stock_solids_collection.add(stock_body)
-            setup.stockSolids = stock_solids_collection 
-
-            # Select origin for Melvin setup
-            sketchPoint = rootComp.constructionPoints.itemByName('Point1')
-            setup.parameters.itemByName('wcs_origin_mode').expression = "'point'"
-            setup.parameters.itemByName('wcs_origin_point').value.value = [sketchPoint]
-            setup.parameters.itemByName('wcs_orientation_flipX').value.value = True
-            setup.parameters.itemByName('wcs_orientation_flipZ').value.value = True
-
-            # Get the model's Y construction axis
-            z_axis_entity = rootComp.yConstructionAxis 
-            # Assign a Python list containing the axis entity directly
-            setup.parameters.itemByName('wcs_orientation_axisZ').value.value = [z_axis_entity]
-            
-            # Load templates from cloud for Melvin
-            template_names_to_load = [
-                    "Melvin 2 Pass NEW"
-                ]
-
-            camManager = adsk.cam.CAMManager.get()
-            libraryManager = camManager.libraryManager
-            templateLibrary = libraryManager.templateLibrary
-
-            cloud_template_url = templateLibrary.urlByLocation(adsk.cam.LibraryLocations.CloudLibraryLocation)
-
-            cloud_templates = list(templateLibrary.childTemplates(cloud_template_url))
-
-            for template_name in template_names_to_load:
-                found_template = [item for item in cloud_templates if item.name == template_name][0] # Assumes template is found
-                setup.createFromCAMTemplate(found_template)
-
-            # Set entry point for Perimeter ToolPath
-            melvin_setup = None
-            for setup_index in range(cam.setups.count):
-                current_setup = cam.setups.item(setup_index)
-                if current_setup.name == "Melvin":
-                    melvin_setup = current_setup
-                    break
-
-            perimeter_op = None
-            for op_index in range(melvin_setup.operations.count):
-                op = melvin_setup.operations.item(op_index)
-                if op.name == "Perimeter":
-                    perimeter_op = op
-                    break 
-
-            perimeter_op.parameters.itemByName('entryPositions').value.value = [sketchPoint]
+        times = {}
+        if os.path.exists(stock_times):
+            with open(stock_times, "r") as json_file:
+                times = json.load(json_file)
+
+        totals = {}
+        for job in ctx.toolpath_jobs:
+            operation = job["operation"]
+            if operation.hasError or job["end"] is None:
+                continue
+            setup_name = operation.parentSetup.name
+            mode = "box" if operation.parentSetup.stockSolids.count == 0 else "solid"
+            other = "solid" if mode == "box" else "box"
+            seconds = job["seconds"]
+            recorded = times.setdefault(job["name"], {})
+
+            total = totals.setdefault(setup_name, {"mode": mode, "other": other, "seconds": 0.0, "compared": 0.0, "otherSeconds": 0.0})
+            total["seconds"] += seconds
+            if other in recorded:
+                total["compared"] += seconds
+                total["otherSeconds"] += recorded[other]["seconds"] / recorded[other]["count"]
+
+            average = recorded.setdefault(mode, {"seconds": 0.0, "count": 0})
+            average["seconds"] += seconds
+            average["count"] += 1
+
+        for setup_name, total in totals.items():
+            message = f"{setup_name} toolpaths: {total['seconds']:.1f} s with {total['mode']} stock"
+            if total["otherSeconds"]:
+                message += (f", the same toolpaths averaged {total['otherSeconds']:.1f} s with {total['other']} stock "
+                            f"({total['compared']:.1f} s now)")
+            ctx.details.append(message + ".")
+
+        if totals:
+            os.makedirs(os.path.dirname(stock_times), exist_ok=True)
+            with open(stock_times, "w") as json_file:
+                json.dump(times, json_file, indent=4)
     except:
-        ui.messageBox(f"melvinSetup(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"stockTimes(): failed:\n{traceback.format_exc()}")
 
-def charlesSetup():
+def cycleTimes():           # This function totals the machining time estimate of the generated operations per machine.
     try:
-        
-        
-        # Checks for total thickness of panel. Could get false positive for panels with bumps but not foam.
-        for body in rootComp.bRepBodies:
-            if body.name == "Exterior":  
-                boundingBox = body.boundingBox
-
-        for body in rootComp.bRepBodies:
-            if body.name == "Exterior":  
-                boundingBox = body.boundingBox
-                width =  (abs(boundingBox.minPoint.y) - abs(boundingBox.maxPoint.y)) / 2.54
-                #ui.messageBox(f"Exterior thickness = {width}")
-                if width > (6.9):
-                    foamresult = True
-
-        
-
-        #if foamresult == True:
-        if foamresult == True:
-            # Create a SetupsInput object to define a milling setup.
-            setupInput = setups.createInput(adsk.cam.OperationTypes.MillingOperation)
-
-            # Get the CAM product from the document's products collection
-            doc = app.activeDocument
-            cam_product = doc.products.itemByProductType('CAMProductType')
-            cam = adsk.cam.CAM.cast(cam_product)
-
-            # Specify the first body in the model as the model geometry.
-            camOcc = cam.designRootOccurrence
-            setupInput.models = [camOcc.bRepBodies[0]]
-
-            # Set the origin to be at the top center of the model box.
-            originParam = setupInput.parameters.itemByName('wcs_origin_mode')
-            choiceVal: adsk.cam.ChoiceParameterValue = originParam.value
-            choiceVal.value = 'modelPoint'
-
-            originPoint = setupInput.parameters.itemByName('wcs_origin_boxPoint')
-            choiceVal: adsk.cam.ChoiceParameterValue = originPoint.value
-            choiceVal.value = 'top center'
-
-            # Set the comment for the program.
-            #commentParam = setupInput.parameters.itemByName('job_programComment')
-            #commentParam.value.value = 'This is the comment.'
-
-            # Create the setup.
-            global setup
-            setup = setups.add(setupInput)
-
-            # Set the name of the setup to "Melvin"
-            setup.name = "Charles"
-
-            # Set the program name to file name + "M" for Melvin
-            progNameParam = setup.parameters.itemByName('job_programName')
-            stringVal: adsk.cam.StringParameterValue = progNameParam.value
-            current_doc_name = app.activeDocument.name
-            cleaned_name = re.sub(r'\s*[vV]\d+', '', current_doc_name) 
-            stringVal.value = (cleaned_name + "C")
-
-            # Find and assign the machine from the Local Library
-            machine_model_to_find = "Charles"
-            found_machine = None
-
-            # Get the CAMManager and LibraryManager
-            camManager = adsk.cam.CAMManager.get()
-            libraryManager = camManager.libraryManager
-
-            # Get the singular MachineLibrary object
-            machineLibrary = libraryManager.machineLibrary
-
-            # Get the URL for the Local machine library location
-            local_machine_url = machineLibrary.urlByLocation(adsk.cam.LibraryLocations.CloudLibraryLocation)
-
-            # Get the machines from this specific local library URL
-            local_machines = list(machineLibrary.childMachines(local_machine_url))
-
-            # Loop through the found machines to find yours by model name
-            for machine_item in local_machines:
-                if machine_item.model == machine_model_to_find:
-                    found_machine = machine_item
-                    break
-                    
-            setup.machine = found_machine
-
-            # Select Stock for Charles setup
-            stock_body = rootComp.bRepBodies.itemByName('Stock')
-
-            # Change stock mode
-            prmStockMode = setup.parameters.itemByName('job_stockMode')
-            prmStockMode.expression = "'solid'"
-
-            stock_solids_collection = adsk.core.ObjectCollection.create()
-            stock_solids_collection.add(stock_body)
-            setup.stockSolids = stock_solids_collection 
-
-            # Set Origin
-            sketchPoint = rootComp.constructionPoints.itemByName('Point2')
-            setup.parameters.itemByName('wcs_origin_mode').expression = "'point'"
-            setup.parameters.itemByName('wcs_origin_point').value.value = [sketchPoint]
-            setup.parameters.itemByName('wcs_orientation_flipX').value.value = True
-            setup.parameters.itemByName('wcs_orientation_flipZ').value.value = True
-
-            # Get the model's Y construction axis
-            z_axis_entity = rootComp.yConstructionAxis 
-            # Assign a Python list containing the axis entity directly
-            setup.parameters.itemByName('wcs_orientation_axisZ').value.value = [z_axis_entity]
-            
-            template_names_to_load = []
-            # Load templates from cloud for Charles
-            template_names_to_load.extend([
-                    "Charles Facinghead",
-                    "Charles Perimeter",
-                    "Charles Perimeter Above Sheathing"
-            ])
-
-            if any("Bump" in body.name for body in rootComp.bRepBodies):
-                template_names_to_load.append("Charles Bump Clean Up FM")
-
-            if brickDetail():
-                template_names_to_load.extend([
-                        "Charles Brick Feature EM",
-                        "Charles Brick Feature FM"
-                    ])
-        
-            if is_return_result == adsk.core.DialogResults.DialogYes:
-                # Load templates from cloud for Charles
-                template_names_to_load.extend([
-                        "Charles Return EM",
-                        "Charles Return FM"
-                    ])
-                
-            if west_return == True:
-                template_names_to_load.extend([
-                        "Charles Return EM",
-                        "Charles Return FM"
-                    ])
-        
-            camManager = adsk.cam.CAMManager.get()
-            libraryManager = camManager.libraryManager
-            templateLibrary = libraryManager.templateLibrary
-
-            cloud_template_url = templateLibrary.urlByLocation(adsk.cam.LibraryLocations.CloudLibraryLocation)
-
-            cloud_templates = list(templateLibrary.childTemplates(cloud_template_url))
-
-            for template_name in template_names_to_load:
-                found_template = [item for item in cloud_templates if item.name == template_name][0] 
-                setup.createFromCAMTemplate(found_template)
-        else:
-            addMessage("\"Foam\" body could not be found: The Charles setup will not be created.")
-
-        if any("Bump" in body.name for body in rootComp.bRepBodies):
-            bumpMod()
+        cycle_times = {}
+        for setup in ctx.setups:
+            settings = machine_times.get(setup.name)
+            if not settings:
+                continue
+            seconds, counted, missing = 0.0, 0, 0
+            for operation in setup.allOperations:
+                if not operation.hasToolpath:
+                    missing += 1
+                    continue
+                estimate = ctx.cam.getMachiningTime(operation, 100, settings["rapidFeed"], settings["toolChange"])
+                seconds += estimate.machiningTime
+                counted += 1
+            # A machine without toolpaths would be logged as taking no time and skew the suggested order.
+            if counted:
+                cycle_times[setup.name] = {"operations": counted, "seconds": seconds}
+
+            message = f"{setup.name} cycle time: {seconds / 60:.1f} min ({counted} operations)"
+            if missing:
+                message += f", {missing} operations without a toolpath are not included"
+            if not counted:
+                message += ", not added to the shift log"
+            ctx.details.append(message + ".")
+
+        if cycle_times:
+            ShiftPlanner.appendShiftLog(shift_log, time.strftime("%Y-%m-%d %H:%M"),
+                                        PanelLogic.panelNumber(app.activeDocument.name), cycle_times)
     except:
-        ui.messageBox(f"charlesSetup(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"cycleTimes(): failed:\n{traceback.format_exc()}")
 
-def bumpMod():              # This function modifies the Facinghead toolpath if a bump is decected
+def postPrograms():         # This function posts the Melvin and Charles programs into the NC output folder.
     try:
-        for body in rootComp.bRepBodies:
-            # Check if the body's name is "sheathing" (case-sensitive)
-            if body.name.startswith("Bump"):
-                body.isVisible = True
+        if not os.path.isdir(post_output_folder):
+            addMessage(f"NC output folder could not be found: {post_output_folder}. Programs were not posted.")
+            return
 
-        if eastBump == True:
-            facinghead_input = setup.operations.itemByName('Facinghead')
-            facinghead_input.parameters.itemByName('passAngle').expression = '0 deg'
-            facinghead_input.parameters.itemByName('transitionType').expression = "'straight-line'"
-            cam.generateToolpath(facinghead_input)
-        elif westBump == True:
-            facinghead_input = setup.operations.itemByName('Facinghead')
-            facinghead_input.parameters.itemByName('passAngle').expression = '180 deg'
-            facinghead_input.parameters.itemByName('transitionType').expression = "'straight-line'"
-            cam.generateToolpath(facinghead_input)
-        else:
-            None
+        # The manifest remembers the operation signatures of the last post of each program.
+        manifest_path = os.path.join(post_output_folder, "post_manifest.json")
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+
+        # Fusion can only post on the main thread, so the programs are posted one after the other.
+        for setup_index in range(ctx.cam.setups.count):
+            post_setup = ctx.cam.setups.item(setup_index)
+            if post_setup.name not in post_processors:
+                continue
+
+            program_name = post_setup.parameters.itemByName('job_programName').value.value
+            operations = list(post_setup.allOperations)
+
+            if not operations or not all(op.hasToolpath and op.isToolpathValid for op in operations):
+                addMessage(f"{post_setup.name} toolpaths are not valid: {program_name} was not posted.")
+                continue
+
+            signatures = {op.name: operationSignature(op) for op in operations}
+            nc_files = [name for name in os.listdir(post_output_folder) if os.path.splitext(name)[0] == program_name]
+            if manifest.get(program_name) == signatures and nc_files:
+                addMessage(f"{program_name} is unchanged since the last post.")
+                continue
+
+            post_config = os.path.join(ctx.cam.personalPostFolder, post_processors[post_setup.name])
+            post_input = adsk.cam.PostProcessInput.create(program_name, post_config, post_output_folder,
+                                                          adsk.cam.PostOutputUnitOptions.InchesOutput)
+            post_input.isOpenInEditor = False
+
+            start = time.time()
+            ctx.cam.postProcess(post_setup, post_input)
+            manifest[program_name] = signatures
+            addMessage(f"{program_name} posted for {post_setup.name} in {time.time() - start:.1f} s.")
+            nc_file = postedFile(program_name)
+            if nc_file:
+                if compact_programs:
+                    compactProgram(program_name, nc_file)
+                validateProgram(post_setup.name, program_name, nc_file)
+
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
     except:
-        ui.messageBox(f"bumpMod(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"postPrograms(): failed:\n{traceback.format_exc()}")
 
-def thinFoam():
-    try:
-        for body in rootComp.bRepBodies:
-            if body.name == "Exterior":  
-                boundingBox = body.boundingBox
-                width =  (abs(boundingBox.minPoint.y) - abs(boundingBox.maxPoint.y)) / 2.54
-                #ui.messageBox(f"Exterior thickness = {width}")
-                    
-        if width > 6.9 and width < 9.25:
-            facinghead_input = setup.operations.itemByName('Facinghead')
-            facinghead_input.parameters.itemByName('bottomHeight_offset').expression = '8.25 in'
-            facinghead_input.parameters.itemByName('topHeight_offset').expression = '8.5 in'
-            cam.generateToolpath(facinghead_input)
-
-            if setup.operations.itemByName('Brick Feature EM'):
-                brick_em_input = setup.operations.itemByName('Brick Feature EM')
-                brick_em_input.parameters.itemByName('bottomHeight_offset').expression = '7.75 in'
-                cam.generateToolpath(brick_em_input)
-
-            if setup.operations.itemByName('Brick Feature FM'):
-                brick_fm_input = setup.operations.itemByName('Brick Feature FM')
-                brick_fm_input.parameters.itemByName('bottomHeight_offset').expression = '7.75 in'
-                cam.generateToolpath(brick_fm_input)
-            
-    except:
-        ui.messageBox(f"thinFoam(): failed:\n{traceback.format_exc()}")
+def postedFile(program_name):  # This function returns the newest posted file of a program, None if there is none.
+    nc_files = [os.path.join(post_output_folder, name) for name in os.listdir(post_output_folder)
+                if os.path.splitext(name)[0] == program_name]
+    return max(nc_files, key=os.path.getmtime) if nc_files else None
 
-def foamErrorDetection(): 
-    try: 
-        # Iterate through all bodies within the current component
-        for body in rootComp.bRepBodies:
-            # Check if the body's name is "sheathing" (case-sensitive)
-            if body.name == "Sheathing" or body.name.lower() == "foam":
-                body.isVisible = True
-
-        if foamresult == True:
-            # Get the "Foam" and "Sheathing" bodies
-            foamBody = None
-            sheathingBody = None
-            
-            #for body in camOcc.bRepBodies:
-            for body in rootComp.bRepBodies:
-                if body.name == "Foam":
-                    foamBody = body
-                elif body.name == "Sheathing":
-                    sheathingBody = body
-
-            if not foamBody:
-                addMessage('"Foam" body could not be found: Error Dectection could not be evaluated.')
-                return
-            if not sheathingBody:
-                addMessage('"Sheathing" body could not be found: Error Dectection could not be evaluated.')
+def compactProgram(program_name, nc_file):  # This function replaces a posted program by its compacted version.
+    try:
+        compacted = nc_file + ".compact"
+        report = NCCompactor.compact(nc_file, compacted, compact_tolerance)
+        if compact_verify:
+            checked = NCCompactor.verify(nc_file, compacted, compact_tolerance)
+            if not checked["ok"]:
+                os.remove(compacted)
+                if "error" in checked:
+                    addMessage(f"{program_name} was not compacted: {checked['error']}")
+                else:
+                    addMessage(f"{program_name} was not compacted: The compacted path was {checked['maxDeviation']:.4f}\" from the posted path.")
                 return
+        os.replace(compacted, nc_file)
+        ctx.details.append(NCCompactor.summary(program_name, report) + ".")
+    except:
+        ui.messageBox(f"compactProgram(): failed:\n{traceback.format_exc()}")
 
-            # Get the bounding boxes for each body
-            foamBounds = foamBody.boundingBox
-            sheathingBounds = sheathingBody.boundingBox
-
-            # Calculate dimensions for Foam
-            foamLength = foamBounds.maxPoint.x - foamBounds.minPoint.x
-            foamHeight = foamBounds.maxPoint.z - foamBounds.minPoint.z
-
-            # Calculate dimensions for Sheathing
-            sheathingLength = sheathingBounds.maxPoint.x - sheathingBounds.minPoint.x
-            sheathingHeight = sheathingBounds.maxPoint.z - sheathingBounds.minPoint.z
-            
-            # Define the tolerance
-            tolerance = 1.0 * 2.54 
-
-            # Calculate differences and convert to inches
-            diffLength = abs((foamLength - sheathingLength) / 2.54)
-            diffHeight = abs((foamHeight - sheathingHeight) / 2.54)
-
-            if diffLength > 0.003 or diffHeight > 0.003:
-                # Prepare the message for differences less than 1 inch
-                alert_messages = []
-                if diffLength < tolerance:
-                    alert_messages.append(f"X difference: {diffLength:.3f} inches")
-                if diffHeight < tolerance and diffHeight > 0.003:
-                    alert_messages.append(f"Z difference: {diffHeight:.3f} inches")
-
-                if alert_messages:
-                    message = "The dimension difference between 'Foam' and 'Sheathing' is less than 1 inch in the following directions:\n"
-                    message += "\n".join(alert_messages)
-                    #ui.messageBox(message, 'Dimension Alert')
-                else:
-                    message = "\u2022 Difference between the 'Foam' and 'Sheathing' has been deteceted:\n"
-                    if diffLength > 0.003:
-                        message += f"       \u2022 X axis: {diffLength:.3f} inches"
-                    if diffHeight > 0.003:
-                        message += f"       \u2022 Z axis: {diffHeight:.3f} inches"
-                    #ui.messageBox(message, 'Dimension Alert')
-                report_message.append(message)
+def validateProgram(machine, program_name, nc_file):  # This function checks a posted program against the machine envelope.
+    try:
+        if machine not in NCValidator.machine_profiles:
+            return
+        report = NCValidator.validate(nc_file, machine)
+        ctx.details.append(NCValidator.summary(report) + ".")
+        for found in report["problems"]:
+            addMessage(f"{program_name}: {found}")
     except:
-        ui.messageBox(f"foamErrorDection(): failed:\n{traceback.format_exc()}")
+        ui.messageBox(f"validateProgram(): failed:\n{traceback.format_exc()}")
 
 def showAllMessages():
     try:
-        if len(report_message) == 0:
+        if len(ctx.report_message) == 0:
             addMessage("Everything looks great!")
 
-        full_message = "\n".join(report_message)
+        # The prefetcher may have cached the panel since openBIM looked it up.
+        panel_number = PanelLogic.panelNumber(app.activeDocument.name)
+        if ctx.bim is None:
+            ctx.bim = BIMCache.lookup(bim_cache, panel_number)
+        if ctx.bim:
+            ctx.details.insert(0, f"BIM {panel_number}: {BIMCache.summaryLine(ctx.bim, bim_summary_fields)}")
+
+        full_message = "\n".join(ctx.report_message)
+        if ctx.details:
+            full_message += "\n\n" + "\n".join(ctx.details)
+        ctx.summary = full_message
+        if queue_summary is not None:
+            return              # The queue shows the summaries of all its panels together.
         ui.messageBox(full_message, "Script Summary", 
                     adsk.core.MessageBoxButtonTypes.OKButtonType,
                     adsk.core.MessageBoxIconTypes.InformationIconType)
@@ -0,0 +1,84 @@
+# Melvin/Charles load-balancing planner for the panel queue.
+# Reads the cycle times PanelStartUp appends to the shift log and suggests the order that keeps both machines busy.
+# Every panel is machined on the machines in machine_order one after the other, so the order that finishes the queue
+# first is found with Johnson's rule for two machines. Runs without Fusion:
+#
+#   python ShiftPlanner.py "Panel Shift Log.csv"                 plan every panel in the log
+#   python ShiftPlanner.py "Panel Shift Log.csv" 1234 1235 1240  plan the listed panels
+
+import argparse, csv, os, sys
+
+# Order the panels go through the machines.
+machine_order = ["Melvin", "Charles"]
+
+# Shift log columns, one row per panel and machine.
+log_fields = ["logged", "panel", "machine", "operations", "seconds"]
+
+def appendShiftLog(path, logged, panel, cycle_times):  # This function appends the cycle time of each machine of a panel to the shift log.
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as log_file:
+        writer = csv.DictWriter(log_file, fieldnames=log_fields)
+        if new_file:
+            writer.writeheader()
+        for machine, cycle in cycle_times.items():
+            writer.writerow({"logged": logged, "panel": panel, "machine": machine,
+                             "operations": cycle["operations"], "seconds": round(cycle["seconds"], 1)})
+
+def readShiftLog(path):     # This function returns the cycle times in seconds by panel and machine, the last logged run of a panel wins.
+    times = {}
+    with open(path, "r", newline="") as log_file:
+        for row in csv.DictReader(log_file):
+            times.setdefault(row["panel"], {})[row["machine"]] = float(row["seconds"])
+    return times
+
+def balanceOrder(times, panels=None):  # This function orders the panels with Johnson's rule to finish the queue as early as possible.
+    first, second = machine_order
+    panels = list(times) if panels is None else panels
+    lead = [p for p in panels if times[p].get(first, 0) < times[p].get(second, 0)]
+    tail = [p for p in panels if p not in lead]
+    lead.sort(key=lambda p: times[p].get(first, 0))
+    tail.sort(key=lambda p: times[p].get(second, 0), reverse=True)
+    return lead + tail
+
+def schedule(times, order):  # This function returns when each machine finishes the queue and how long it waits for the other machine.
+    finish = {machine: 0.0 for machine in machine_order}
+    idle = {machine: 0.0 for machine in machine_order}
+    for panel in order:
+        ready = 0.0
+        for machine in machine_order:
+            start = max(finish[machine], ready)
+            idle[machine] += start - finish[machine]
+            finish[machine] = start + times[panel].get(machine, 0)
+            ready = finish[machine]
+    return {"finish": finish, "idle": idle, "makespan": max(finish.values())}
+
+def report(times, panels=None):  # This function compares the queue in its given order with the balanced order.
+    queue = list(times) if panels is None else panels
+    missing = [p for p in queue if p not in times]
+    queue = [p for p in queue if p in times]
+    balanced = balanceOrder(times, queue)
+    before, after = schedule(times, queue), schedule(times, balanced)
+
+    lines = [f"Panels not in the shift log: {', '.join(missing)}"] if missing else []
+    lines.append("Suggested order:")
+    for i, panel in enumerate(balanced, 1):
+        cycle = ", ".join(f"{m} {times[panel].get(m, 0) / 60:.1f} min" for m in machine_order)
+        lines.append(f"  {i}. {panel} ({cycle})")
+    for name, result in [("Queue order", before), ("Suggested order", after)]:
+        idle = ", ".join(f"{m} idle {result['idle'][m] / 60:.1f} min" for m in machine_order)
+        lines.append(f"{name}: done after {result['makespan'] / 60:.1f} min ({idle})")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest a Melvin/Charles panel order from the shift log.")
+    parser.add_argument("log", help="shift log written by PanelStartUp")
+    parser.add_argument("panels", nargs="*", help="panels in the queue, every logged panel if omitted")
+    args = parser.parse_args()
+    print(report(readShiftLog(args.log), args.panels or None))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
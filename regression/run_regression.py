@@ -0,0 +1,253 @@
+# Golden-corpus regression gate for the panel decision logic.
+# Replays the anonymized panel snapshots in corpus/ through PanelLogic.preflight and buildPlan without Fusion, compares each plan
+# with its golden output in golden/ and checks the step times against budgets.json.
+# The sample programs in nc/ (named <machine>-<name>.ngc) are checked with NCValidator and compared with golden/nc/,
+# and compacted with NCCompactor, which must stay within its tolerance of the posted path.
+# The toolpath fingerprints are checked to change with the parameters and stock and nothing else, and the parameter
+# handles are checked against a stand-in parameter collection, and the largest plane of a slab is checked to tell its
+# front from its back.
+#
+#   python regression/run_regression.py            check the corpus
+#   python regression/run_regression.py --update   rewrite the golden outputs after an intended change
+
+import argparse, json, os, sys, tempfile, time
+
+regression_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(regression_folder))
+
+import PanelLogic, NCValidator, NCCompactor
+
+# Plan fields that change from run to run and are checked against the budgets instead of the golden output.
+timing_fields = ["timings", "planTime"]
+
+def loadJson(path):
+    with open(path, "r") as json_file:
+        return json.load(json_file)
+
+def comparable(value):      # This function rounds the floats of a plan so it can be compared with the golden output.
+    if isinstance(value, float):
+        return round(value, 6) + 0.0
+    if isinstance(value, dict):
+        return {key: comparable(item) for key, item in value.items() if key not in timing_fields}
+    if isinstance(value, list):
+        return [comparable(item) for item in value]
+    return value
+
+def snapshot(panel):        # This function measures the corpus bodies that have a mesh the way the script measures the Fusion bodies.
+    # A mesh is stored as the flat node coordinates and indices Fusion returns, without NumPy the given extents are used.
+    bodies = []
+    for corpus_body in panel["bodies"]:
+        body = {key: value for key, value in corpus_body.items() if key != "mesh"}
+        mesh = corpus_body.get("mesh")
+        if mesh and PanelLogic.np is not None:
+            vertices, triangles = PanelLogic.meshArrays(mesh["coordinates"], mesh["indices"])
+            body["min"], body["max"] = PanelLogic.meshExtents(vertices)
+            body["thickness"] = PanelLogic.meshThickness(PanelLogic.yPlanes(vertices, triangles), (body["min"], body["max"]))
+        bodies.append(body)
+    return bodies
+
+def replay(panel, repeat):  # This function plans a corpus panel and returns the plan with the fastest time of each step.
+    best = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bodies = snapshot(panel)
+        snapshot_time = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        checks = PanelLogic.preflight(bodies)
+        preflight_time = (time.perf_counter() - start) * 1000
+        plan = PanelLogic.buildPlan(bodies, panel["document"], panel.get("rotation"), panel.get("templates"))
+        plan["preflight"] = checks
+        plan["timings"]["snapshot"] = snapshot_time
+        plan["timings"]["preflight"] = preflight_time
+        for name, value in plan["timings"].items():
+            best[name] = min(best.get(name, value), value)
+    plan["timings"] = best
+    return plan
+
+def fingerprintChecks():   # This function checks that the toolpath fingerprints only change when the parameters or stock change.
+    failures = []
+    if PanelLogic.geometryHash([1.0, 2.0, 3.0]) != PanelLogic.geometryHash([1.00001, 1.99999, 3.0]):
+        failures.append("geometryHash changed below its rounding")
+    if PanelLogic.geometryHash([1.0, 2.0, 3.0]) == PanelLogic.geometryHash([1.0, 2.001, 3.0]):
+        failures.append("geometryHash did not change with the geometry")
+
+    stock = PanelLogic.geometryHash([0.0, 0.0, 0.0, 10.0, 20.0, 30.0])
+    expressions = {"passAngle": "0 deg", "topHeight_offset": "9.5 in", "tolerance": "0.001 in"}
+    fingerprint = PanelLogic.toolpathFingerprint(expressions, stock)
+    same = [
+        ("the parameter order", dict(reversed(list(expressions.items()))), stock),
+        ("a parameter that is not fingerprinted", dict(expressions, tolerance="0.002 in"), stock)
+    ]
+    changed = [
+        ("passAngle", dict(expressions, passAngle="180 deg"), stock),
+        ("a missing parameter", {"passAngle": "0 deg"}, stock),
+        ("the stock", expressions, PanelLogic.geometryHash([0.0, 0.0, 0.0, 10.0, 20.0, 31.0]))
+    ]
+    for name, values, stock_hash in same:
+        if PanelLogic.toolpathFingerprint(values, stock_hash) != fingerprint:
+            failures.append(f"toolpathFingerprint changed with {name}")
+    for name, values, stock_hash in changed:
+        if PanelLogic.toolpathFingerprint(values, stock_hash) == fingerprint:
+            failures.append(f"toolpathFingerprint did not change with {name}")
+    return failures
+
+class StandInValue:         # Stand-in for the value object of a Fusion parameter.
+    def __init__(self, value):
+        self.value = value
+
+class StandInParameter:     # Stand-in for a Fusion parameter, a locked parameter raises when it is set like Fusion does.
+    def __init__(self, expression, value, locked=False):
+        self._expression = expression
+        self.value = StandInValue(value)
+        self.locked = locked
+
+    @property
+    def expression(self):
+        return self._expression
+
+    @expression.setter
+    def expression(self, expression):
+        if self.locked:
+            raise RuntimeError("parameter is read-only")
+        self._expression = expression
+
+class StandInParameters:    # Stand-in for a Fusion parameter collection that counts the lookups by name.
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.lookups = {}
+
+    def itemByName(self, name):
+        self.lookups[name] = self.lookups.get(name, 0) + 1
+        return self.parameters.get(name)
+
+def parameterChecks():      # This function checks applyParameters against a stand-in parameter collection.
+    failures = []
+    parameters = StandInParameters({
+        "passAngle": StandInParameter("90 deg", 90.0),
+        "wcs_orientation_flipX": StandInParameter("false", False),
+        "job_stockMode": StandInParameter("'solid'", "solid", locked=True)
+    })
+    handles = {}
+    values = {"passAngle": "0 deg", "wcs_orientation_flipX": True, "job_stockMode": "'fixedbox'", "missing": "1 in"}
+    failed = PanelLogic.applyParameters(parameters, values, handles)
+    failed += PanelLogic.applyParameters(parameters, {"passAngle": "180 deg"}, handles)
+
+    if any(count != 1 for count in parameters.lookups.values()) or set(parameters.lookups) != set(values):
+        failures.append(f"applyParameters looked the parameters up more than once: {parameters.lookups}")
+    if parameters.parameters["passAngle"].expression != "180 deg":
+        failures.append("applyParameters did not set a string as the expression")
+    if parameters.parameters["wcs_orientation_flipX"].value.value is not True:
+        failures.append("applyParameters did not set a value through value.value")
+    if not any(found.startswith("missing:") for found in failed):
+        failures.append("applyParameters did not report a missing parameter")
+    if not any(found.startswith("job_stockMode:") for found in failed):
+        failures.append("applyParameters did not report a parameter that could not be set")
+    if len(failed) != 2:
+        failures.append(f"applyParameters reported unexpected failures: {failed}")
+    return failures
+
+def quadMesh(quads):        # This function builds the vertex and triangle arrays of a mesh from quads given counterclockwise from outside.
+    vertices = PanelLogic.np.array([corner for quad in quads for corner in quad], dtype=float)
+    triangles = PanelLogic.np.array([[4 * i + j for j in triangle] for i in range(len(quads)) for triangle in [(0, 1, 2), (0, 2, 3)]])
+    return vertices, triangles
+
+def frontChecks():          # This function checks that the largest plane of a slab is only taken as its front when it is larger than the back.
+    if PanelLogic.np is None:
+        return []
+    failures = []
+    front = [[0, 0, 0], [10, 0, 0], [10, 0, 5], [0, 0, 5]]
+    back = [[0, 1, 0], [0, 1, 5], [10, 1, 5], [10, 1, 0]]
+    cut_back = [[0, 1, 0], [0, 1, 5], [9, 1, 5], [9, 1, 0]]
+    if PanelLogic.largestPlaneNormal(*quadMesh([front, back])) is not None:
+        failures.append("largestPlaneNormal chose a front on a slab whose front and back are the same size")
+    normal = PanelLogic.largestPlaneNormal(*quadMesh([front, cut_back]))
+    if normal is None or normal[1] > -0.999:
+        failures.append(f"largestPlaneNormal did not find the front of a slab with a return: {normal}")
+    if PanelLogic.largestPlaneNormal(*quadMesh([[[0, 0, 0], [10, 0, 0], [10, 0, 0], [0, 0, 0]]])) is not None:
+        failures.append("largestPlaneNormal returned a normal for a mesh without area")
+    return failures
+
+def differences(expected, actual, path=""):  # This function lists where a plan differs from its golden output.
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        found = []
+        for key in sorted(set(expected) | set(actual)):
+            found.extend(differences(expected.get(key), actual.get(key), f"{path}.{key}" if path else key))
+        return found
+    if isinstance(expected, list) and isinstance(actual, list) and len(expected) == len(actual):
+        found = []
+        for i, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+            found.extend(differences(expected_item, actual_item, f"{path}[{i}]"))
+        return found
+    return [] if expected == actual else [f"{path}: expected {expected!r}, got {actual!r}"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the panel corpus and compare the plans with the golden outputs.")
+    parser.add_argument("--update", action="store_true", help="rewrite the golden outputs from the current plans")
+    args = parser.parse_args()
+
+    budgets = loadJson(os.path.join(regression_folder, "budgets.json"))
+    corpus_folder = os.path.join(regression_folder, "corpus")
+    golden_folder = os.path.join(regression_folder, "golden")
+
+    failures = fingerprintChecks() + parameterChecks() + frontChecks()
+    for file_name in sorted(os.listdir(corpus_folder)):
+        if not file_name.endswith(".json"):
+            continue
+        panel_name = os.path.splitext(file_name)[0]
+        plan = replay(loadJson(os.path.join(corpus_folder, file_name)), budgets["repeat"])
+        golden_path = os.path.join(golden_folder, file_name)
+
+        if args.update:
+            golden = comparable(plan)
+            with open(golden_path, "w") as golden_file:
+                json.dump(golden, golden_file, indent=4)
+            print(f"{panel_name}: golden output updated")
+            continue
+
+        if not os.path.exists(golden_path):
+            failures.append(f"{panel_name}: no golden output, run with --update")
+            continue
+
+        golden = loadJson(golden_path)
+        failures.extend(f"{panel_name}: {difference}" for difference in differences(comparable(golden), comparable(plan)))
+
+        for step, elapsed in plan["timings"].items():
+            budget = budgets["steps"].get(step)
+            if budget is None:
+                failures.append(f"{panel_name}: step '{step}' has no time budget")
+            elif elapsed > budget:
+                failures.append(f"{panel_name}: step '{step}' took {elapsed:.3f} ms, budget {budget} ms")
+
+        print(f"{panel_name}: {sum(plan['timings'].values()):.3f} ms, {plan['apiCalls']} estimated API calls")
+
+    # Posted program samples.
+    nc_folder = os.path.join(regression_folder, "nc")
+    os.makedirs(os.path.join(golden_folder, "nc"), exist_ok=True)
+    for file_name in sorted(os.listdir(nc_folder)) if os.path.isdir(nc_folder) else []:
+        machine = file_name.split("-")[0]
+        report = NCValidator.validate(os.path.join(nc_folder, file_name), machine)
+        golden_path = os.path.join(golden_folder, "nc", os.path.splitext(file_name)[0] + ".json")
+        if args.update:
+            with open(golden_path, "w") as golden_file:
+                json.dump(comparable(report), golden_file, indent=4)
+            print(f"{file_name}: golden report updated")
+        elif not os.path.exists(golden_path):
+            failures.append(f"{file_name}: no golden report, run with --update")
+        else:
+            failures.extend(f"{file_name}: {difference}" for difference in differences(comparable(loadJson(golden_path)), comparable(report)))
+            print(f"{file_name}: {len(report['problems'])} problems")
+
+            with tempfile.TemporaryDirectory() as folder:
+                compacted_path = os.path.join(folder, file_name)
+                NCCompactor.compact(os.path.join(nc_folder, file_name), compacted_path)
+                checked = NCCompactor.verify(os.path.join(nc_folder, file_name), compacted_path)
+            if not checked["ok"]:
+                failures.append(f"{file_name}: compacted program " +
+                                checked.get("error", f"is {checked['maxDeviation']:.5f} from the posted path"))
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())